@@ -51,6 +51,7 @@ Uso:
 """
 
 import argparse
+import os
 import sys
 import subprocess
 import json
@@ -81,7 +82,9 @@ DATASET_NAME = "settings"
 TABLE_NAME = "companies"
 
 # Permisos incluidos en el rol (puedes expandir esto fácilmente)
-CUSTOM_ROLE_PERMISSIONS = [
+# tuple(dict.fromkeys(...)) elimina duplicados preservando el orden:
+# un permiso repetido haría que gcloud rechace el YAML completo
+CUSTOM_ROLE_PERMISSIONS = tuple(dict.fromkeys([
     # Permisos para leer datos (equivalente a dataViewer)
     "bigquery.datasets.get",
     "bigquery.datasets.getIamPolicy",
@@ -94,29 +97,66 @@ CUSTOM_ROLE_PERMISSIONS = [
     "bigquery.tables.getData",
     "bigquery.tables.list",
     "bigquery.tables.export",
-    
+
     # Permisos para ejecutar queries (equivalente a jobUser)
     "bigquery.jobs.create",
     "bigquery.jobs.list",
     "bigquery.jobs.get",
-    
+
     # Permisos adicionales útiles para Google Sheets
     "resourcemanager.projects.get",
-    
+
     # Puedes agregar más permisos aquí según necesites
     # Por ejemplo, para saved queries:
     # "bigquery.savedqueries.get",
     # "bigquery.savedqueries.list",
-]
+]))
 
 class CustomRoleManager:
     """Gestor de Custom Roles"""
-    
-    def __init__(self, project_id: str, dry_run: bool = False):
+
+    # Cache compartido del resultado de query_testable_permissions
+    # (una sola llamada a la API sirve para todos los proyectos)
+    _testable_permissions = None
+
+    def __init__(self, project_id: str, dry_run: bool = False, strict: bool = False):
         self.project_id = project_id
         self.dry_run = dry_run
+        self.strict = strict
         self.role_name = f"projects/{project_id}/roles/{CUSTOM_ROLE_ID}"
-        
+
+    def _validate_permissions(self) -> bool:
+        """Valida que todos los permisos del rol existan realmente en GCP
+
+        Consulta query_testable_permissions una sola vez (se cachea a nivel
+        de clase) y verifica que CUSTOM_ROLE_PERMISSIONS sea un subconjunto.
+        Detecta typos antes de gastar la llamada de creación del rol.
+        """
+        try:
+            if CustomRoleManager._testable_permissions is None:
+                from google.cloud import iam_admin_v1
+
+                logger.info(f"🔍 Validando permisos contra la API de IAM...")
+                client = iam_admin_v1.IAMClient()
+                response = client.query_testable_permissions(
+                    request={
+                        "full_resource_name": f"//cloudresourcemanager.googleapis.com/projects/{self.project_id}"
+                    }
+                )
+                CustomRoleManager._testable_permissions = {p.name for p in response}
+
+            unknown = set(CUSTOM_ROLE_PERMISSIONS) - CustomRoleManager._testable_permissions
+            if unknown:
+                logger.error(f"❌ Permisos desconocidos en CUSTOM_ROLE_PERMISSIONS: {', '.join(sorted(unknown))}")
+                return False
+
+            logger.info(f"✅ Los {len(CUSTOM_ROLE_PERMISSIONS)} permisos son válidos")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Error validando permisos: {str(e)}")
+            return False
+
     def role_exists(self) -> bool:
         """Verifica si el custom role ya existe"""
         try:
@@ -129,7 +169,10 @@ class CustomRoleManager:
     
     def create_role(self) -> bool:
         """Crea el custom role"""
-        
+
+        if self.strict and not self._validate_permissions():
+            return False
+
         if self.role_exists():
             logger.warning(f"⚠️  El rol '{CUSTOM_ROLE_ID}' ya existe en el proyecto {self.project_id}")
             logger.info(f"💡 Usa --action update para modificarlo")
@@ -156,14 +199,14 @@ class CustomRoleManager:
         
         # Guardar configuración temporal
         config_file = f"role_config_{CUSTOM_ROLE_ID}.yaml"
+        permissions_yaml = "\n".join(f"- {perm}" for perm in CUSTOM_ROLE_PERMISSIONS)
         yaml_content = f"""title: "{CUSTOM_ROLE_TITLE}"
 description: "{CUSTOM_ROLE_DESCRIPTION}"
 stage: "GA"
 includedPermissions:
+{permissions_yaml}
 """
-        for perm in CUSTOM_ROLE_PERMISSIONS:
-            yaml_content += f"- {perm}\n"
-        
+
         try:
             with open(config_file, 'w') as f:
                 f.write(yaml_content)
@@ -177,9 +220,8 @@ includedPermissions:
             else:
                 logger.info(f"🚀 Creando custom role...")
                 result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-                
+
                 # Limpiar archivo temporal
-                import os
                 os.remove(config_file)
                 
                 if result.returncode == 0:
@@ -223,7 +265,10 @@ includedPermissions:
     
     def update_role(self, new_permissions: Optional[List[str]] = None) -> bool:
         """Actualiza el custom role con nuevos permisos"""
-        
+
+        if self.strict and not self._validate_permissions():
+            return False
+
         if not self.role_exists():
             logger.error(f"❌ El rol '{CUSTOM_ROLE_ID}' no existe")
             logger.info(f"💡 Usa --action create para crearlo primero")
@@ -243,14 +288,14 @@ includedPermissions:
         
         # Crear archivo temporal con la configuración actualizada
         config_file = f"role_config_{CUSTOM_ROLE_ID}_update.yaml"
+        permissions_yaml = "\n".join(f"- {perm}" for perm in permissions_to_use)
         yaml_content = f"""title: "{CUSTOM_ROLE_TITLE}"
 description: "{CUSTOM_ROLE_DESCRIPTION}"
 stage: "GA"
 includedPermissions:
+{permissions_yaml}
 """
-        for perm in permissions_to_use:
-            yaml_content += f"- {perm}\n"
-        
+
         try:
             with open(config_file, 'w') as f:
                 f.write(yaml_content)
@@ -263,9 +308,8 @@ includedPermissions:
             else:
                 logger.info(f"🚀 Actualizando custom role...")
                 result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-                
+
                 # Limpiar archivo temporal
-                import os
                 os.remove(config_file)
                 
                 if result.returncode == 0:
@@ -364,7 +408,6 @@ includedPermissions:
             result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
             
             if result.returncode == 0:
-                import json
                 policy = json.loads(result.stdout)
                 
                 users = []
@@ -470,7 +513,8 @@ includedPermissions:
             # Crear manager para este proyecto
             company_manager = CustomRoleManager(
                 project_id=project_id,
-                dry_run=self.dry_run
+                dry_run=self.dry_run,
+                strict=self.strict
             )
             
             # Crear el rol
@@ -572,6 +616,8 @@ Ejemplos de uso:
     parser.add_argument('--users', help='Lista de usuarios separados por coma (requerido si action=assign, opcional para create-all)')
     parser.add_argument('--dry-run', action='store_true',
                        help='Modo de prueba - muestra qué haría sin ejecutar cambios')
+    parser.add_argument('--strict', action='store_true',
+                       help='Valida CUSTOM_ROLE_PERMISSIONS contra la API de IAM antes de crear/actualizar')
     parser.add_argument('--source-project', default=default_source_project,
                        help=f'Proyecto donde está la tabla companies (default: {default_source_project})')
     
@@ -593,13 +639,15 @@ Ejemplos de uso:
         source_project = args.source_project or default_source_project
         manager = CustomRoleManager(
             project_id=source_project,
-            dry_run=args.dry_run
+            dry_run=args.dry_run,
+            strict=args.strict
         )
     else:
         # Crear gestor para proyecto específico
         manager = CustomRoleManager(
             project_id=args.project,
-            dry_run=args.dry_run
+            dry_run=args.dry_run,
+            strict=args.strict
         )
     
     # Ejecutar acción
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Utilidades compartidas de BigQuery para los scripts de proyectos.
+Centraliza la construcción del cliente, la lectura de la tabla companies
+y el menú interactivo que cada script repetía por su cuenta.
+"""
+import sys
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from google.cloud import bigquery
+
+DATASET_NAME = "settings"
+TABLE_NAME = "companies"
+
+# Columnas habituales de la tabla companies, en el orden canónico
+COMPANY_COLUMNS = ("company_id", "company_name", "company_new_name", "company_project_id")
+
+
+@lru_cache(maxsize=None)
+def bq_client(project, credentials=None):
+    """
+    Un solo cliente BigQuery por proyecto: las credenciales y el pool de
+    conexiones se comparten entre todos los llamadores del proceso
+    """
+    return bigquery.Client(project=project, credentials=credentials)
+
+
+class CompanyRow(NamedTuple):
+    """Fila ligera de la tabla companies (solo las columnas pedidas)"""
+    company_id: int
+    company_name: str = ""
+    company_new_name: Optional[str] = None
+    company_project_id: Optional[str] = None
+
+
+def iter_companies(project, where="", select=COMPANY_COLUMNS, credentials=None):
+    """
+    Lee la tabla companies del proyecto dado y genera CompanyRow.
+    Los resultados se descargan como lotes Arrow vía la Storage Read API
+    (columnar, decodificado en C++) en lugar de fila por fila por REST.
+    """
+    query = f"""
+        SELECT {', '.join(select)}
+        FROM `{project}.{DATASET_NAME}.{TABLE_NAME}`
+        {where}
+        ORDER BY company_id
+    """
+    client = bq_client(project, credentials)
+    table = client.query(query).to_arrow(create_bqstorage_client=True)
+    columns = [table[name].to_pylist() for name in select]
+    for values in zip(*columns):
+        yield CompanyRow(**dict(zip(select, values)))
+
+
+def run_cli(title, modes):
+    """
+    Menú interactivo compartido. modes es {opción: (descripción, función)}.
+    """
+    print(title)
+    print("=" * 60)
+    for key, (description, _) in modes.items():
+        print(f"{key}. {description}")
+    print("=" * 60)
+
+    choice = input(f"Selecciona el modo ({', '.join(modes)}): ").strip()
+
+    if choice in modes:
+        modes[choice][1]()
+    else:
+        print("❌ Opción inválida. Saliendo...")
+        sys.exit(1)
@@ -5,13 +5,53 @@ Script mejorado para crear proyectos GCP, recursos BigQuery y cuentas de servici
 from google.api_core.client_options import ClientOptions
 from google.cloud import resourcemanager_v3
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 from google.cloud import serviceusage_v1
 from google.cloud import iam
-from google.api_core.exceptions import AlreadyExists, PermissionDenied
+from google.api_core.exceptions import (
+    Aborted,
+    AlreadyExists,
+    NotFound,
+    PermissionDenied,
+    ResourceExhausted,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+from google.api_core.future.polling import _OperationNotComplete
+from google.api_core.retry import Retry, if_exception_type
 import argparse
 import logging
-import time
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional
+
+# Política de sondeo para operaciones de larga duración (LRO):
+# backoff exponencial con jitter (1s → 2s → 4s ... máximo 30s) en lugar
+# de un sleep fijo, para reaccionar rápido sin saturar la API.
+# El predicado replica el de polling.DEFAULT_POLLING: sin él, el primer
+# sondeo con la operación aún en curso relanza _OperationNotComplete
+LRO_POLLING = Retry(
+    predicate=if_exception_type(_OperationNotComplete),
+    initial=1.0,
+    maximum=30.0,
+    multiplier=2.0,
+    timeout=600,
+)
+
+
+def _log_retry_attempt(exc):
+    """Deja rastro en el log de cada reintento por error transitorio"""
+    logging.getLogger(__name__).warning(f"Reintentando tras error transitorio: {exc}")
+
+
+# Política de reintentos para errores transitorios (cuota agotada, 503,
+# transacción abortada): backoff exponencial en lugar de abortar la compañía
+_RETRY = Retry(
+    predicate=if_exception_type(ResourceExhausted, ServiceUnavailable, Aborted, TooManyRequests),
+    initial=1.0,
+    maximum=60.0,
+    multiplier=2.0,
+    timeout=600,
+    on_error=_log_retry_attempt,
+)
 
 # Configuración de logging
 logging.basicConfig(
@@ -29,10 +69,15 @@ class GCPProjectCreator:
         self.source_project = source_project
         self.dataset_name = dataset_name
         self.table_name = table_name
+        # Clientes compartidos: construir un cliente implica descubrir
+        # credenciales y abrir un canal gRPC, así que se hace una sola vez
         self.bq_client = bigquery.Client(project=source_project)
+        self.rm_client = resourcemanager_v3.ProjectsClient()
+        self.su_client = serviceusage_v1.ServiceUsageClient()
+        self.iam_client = iam.IAMClient()
         
-    def get_companies_data(self) -> List[Dict[str, Any]]:
-        """Obtiene los datos de compañías desde BigQuery"""
+    def get_companies_data(self) -> Iterator[Dict[str, Any]]:
+        """Obtiene los datos de compañías desde BigQuery (streaming)"""
         query = f"""
             SELECT 
                 company_id, 
@@ -44,19 +89,30 @@ class GCPProjectCreator:
         
         try:
             logger.info(f"Obteniendo datos de compañías desde {self.source_project}.{self.dataset_name}.{self.table_name}")
-            query_job = self.bq_client.query(query)
-            results = query_job.result()
-            
-            companies = []
-            for row in results:
-                companies.append({
-                    "id": row.company_id,
-                    "name": row.company_name,
-                    "new_name": row.company_new_name
-                })
+            query_job = self.bq_client.query(
+                query,
+                job_config=bigquery.QueryJobConfig(use_query_cache=True),
+                retry=_RETRY
+            )
+            # Iterar los resultados por lotes Arrow vía la Storage Read API:
+            # el primer proyecto empieza a crearse mientras llegan las
+            # páginas siguientes, sin materializar toda la tabla en memoria
+            bqs_client = bigquery_storage.BigQueryReadClient()
+            count = 0
+            for batch in query_job.result().to_arrow_iterable(bqstorage_client=bqs_client):
+                for company_id, name, new_name in zip(
+                    batch["company_id"].to_pylist(),
+                    batch["company_name"].to_pylist(),
+                    batch["company_new_name"].to_pylist(),
+                ):
+                    count += 1
+                    yield {
+                        "id": company_id,
+                        "name": name,
+                        "new_name": new_name
+                    }
             
-            logger.info(f"Encontradas {len(companies)} compañías activas")
-            return companies
+            logger.info(f"Encontradas {count} compañías activas")
             
         except Exception as e:
             logger.error(f"Error al obtener datos de BigQuery: {str(e)}")
@@ -67,7 +123,6 @@ class GCPProjectCreator:
         project_id = f"{company['new_name'].replace(' ', '-').lower()}"
         display_name = project_id
         
-        client = resourcemanager_v3.ProjectsClient()
         project = resourcemanager_v3.Project(
             project_id=project_id,
             display_name=display_name,
@@ -79,16 +134,22 @@ class GCPProjectCreator:
         )
         
         try:
+            # Verificación barata antes de lanzar la LRO de creación
+            # (minutos): si el proyecto ya existe, seguir de largo
+            try:
+                self.rm_client.get_project(name=f"projects/{project_id}")
+                logger.warning(f"Proyecto {project_id} ya existe, se omite la creación")
+                return project_id
+            except NotFound:
+                pass
+
             logger.info(f"Creando proyecto {project_id} para {company['name']}")
-            operation = client.create_project(
-                request={"project": project}
+            operation = self.rm_client.create_project(
+                request={"project": project},
+                retry=_RETRY
             )
-            
-            while not operation.done():
-                time.sleep(5)
-                logger.info("Esperando creación de proyecto...")
-            
-            if operation.result().project_id == project_id:
+
+            if operation.result(timeout=600, polling=LRO_POLLING).project_id == project_id:
                 logger.info(f"Proyecto {project_id} creado exitosamente")
                 return project_id
                 
@@ -104,36 +165,42 @@ class GCPProjectCreator:
             
     def enable_services(self, project_id: str, services: List[str]) -> bool:
         """Habilita servicios en un proyecto GCP"""
-        client = serviceusage_v1.ServiceUsageClient()
-        success = True
-        
-        for service in services:
-            service_name = f"{service}.googleapis.com"
-            request = serviceusage_v1.EnableServiceRequest(
-                name=f"projects/{project_id}/services/{service_name}"
-            )
-            
-            try:
-                logger.info(f"Habilitando servicio {service_name} en {project_id}")
-                operation = client.enable_service(request=request)
-                operation.result()
-                logger.info(f"Servicio {service_name} habilitado")
-            except Exception as e:
-                logger.error(f"Error habilitando {service_name}: {str(e)}")
-                success = False
-                
-        return success
+        service_names = [f"{service}.googleapis.com" for service in services]
+
+        # BatchEnableServices habilita hasta 20 servicios en una sola
+        # operación, en lugar de una LRO secuencial por servicio
+        request = serviceusage_v1.BatchEnableServicesRequest(
+            parent=f"projects/{project_id}",
+            service_ids=service_names
+        )
+
+        try:
+            logger.info(f"Habilitando servicios {', '.join(service_names)} en {project_id}")
+            operation = self.su_client.batch_enable_services(request=request, retry=_RETRY)
+            response = operation.result()
+
+            success = True
+            for service in response.services:
+                if service.state != serviceusage_v1.State.ENABLED:
+                    logger.error(f"Servicio {service.name} no quedó habilitado (estado: {service.state.name})")
+                    success = False
+                else:
+                    logger.info(f"Servicio {service.name} habilitado")
+            return success
+
+        except Exception as e:
+            logger.error(f"Error habilitando servicios en {project_id}: {str(e)}")
+            return False
         
     def create_service_account(self, project_id: str) -> Optional[str]:
         """Crea una cuenta de servicio para Fivetran en el proyecto"""
-        client = iam.IAMClient()
         service_account_id = "fivetran-service-account"
         service_account_email = f"{service_account_id}@{project_id}.iam.gserviceaccount.com"
         
         try:
             logger.info(f"Creando cuenta de servicio {service_account_email}")
             
-            service_account = client.create_service_account(
+            service_account = self.iam_client.create_service_account(
                 name=f"projects/{project_id}",
                 service_account_id=service_account_id,
                 service_account={
@@ -154,8 +221,6 @@ class GCPProjectCreator:
             
     def assign_roles_to_service_account(self, project_id: str, service_account_email: str) -> bool:
         """Asigna roles a la cuenta de servicio de Fivetran"""
-        from google.cloud import resourcemanager_v3 as rm
-        
         required_roles = [
             "roles/bigquery.admin",
             "roles/bigquery.connectionUser",
@@ -163,46 +228,52 @@ class GCPProjectCreator:
             "roles/bigquery.jobUser"
         ]
         
-        client = rm.ProjectsClient()
-        success = True
-        
-        for role in required_roles:
-            try:
-                policy = client.get_iam_policy(
+        member = f"serviceAccount:{service_account_email}"
+
+        try:
+            # Obtener la política una sola vez para todos los roles
+            policy = self.rm_client.get_iam_policy(
+                request={
+                    "resource": f"projects/{project_id}",
+                    "options": {"requested_policy_version": 3}
+                }
+            )
+
+            # Conjunto (rol, miembro) para verificar membresía en O(1)
+            # en lugar de recorrer bindings y miembros por cada rol
+            existing_pairs = {
+                (binding.role, m)
+                for binding in policy.bindings
+                for m in binding.members
+            }
+
+            policy_changed = False
+            for role in required_roles:
+                if (role, member) in existing_pairs:
+                    continue
+
+                # Crear nuevo binding si no existe
+                new_binding = resourcemanager_v3.Binding()
+                new_binding.role = role
+                new_binding.members = [member]
+                policy.bindings.append(new_binding)
+                policy_changed = True
+                logger.info(f"Rol {role} asignado a {service_account_email}")
+
+            if policy_changed:
+                # Actualizar política una sola vez con todos los bindings nuevos
+                self.rm_client.set_iam_policy(
                     request={
                         "resource": f"projects/{project_id}",
-                        "options": {"requested_policy_version": 3}
+                        "policy": policy
                     }
                 )
-                
-                # Verificar si el binding ya existe
-                binding_exists = False
-                for binding in policy.bindings:
-                    if binding.role == role and f"serviceAccount:{service_account_email}" in binding.members:
-                        binding_exists = True
-                        break
-                
-                if not binding_exists:
-                    # Crear nuevo binding si no existe
-                    new_binding = rm.Binding()
-                    new_binding.role = role
-                    new_binding.members = [f"serviceAccount:{service_account_email}"]
-                    policy.bindings.append(new_binding)
-                    
-                    # Actualizar política
-                    client.set_iam_policy(
-                        request={
-                            "resource": f"projects/{project_id}",
-                            "policy": policy
-                        }
-                    )
-                    logger.info(f"Rol {role} asignado a {service_account_email}")
-                
-            except Exception as e:
-                logger.error(f"Error asignando rol {role}: {str(e)}")
-                success = False
-                
-        return success
+
+            return True
+
+        except Exception as e:
+            logger.error(f"Error asignando roles: {str(e)}")
+            return False
         
     def setup_bigquery(self, project_id: str, company: Dict[str, Any]) -> bool:
         """Configura los recursos iniciales de BigQuery"""
@@ -7,9 +7,11 @@ from google.cloud import bigquery
 from google.cloud import resourcemanager_v3
 from google.cloud import service_usage_v1
 from google.api_core.exceptions import AlreadyExists, PermissionDenied
+from aiolimiter import AsyncLimiter
 import argparse
+import asyncio
 import logging
-import time
+import os
 from typing import Dict, Any, List, Optional
 
 # Configuración de logging
@@ -29,6 +31,10 @@ class GCPProjectCreator:
         self.dataset_name = dataset_name
         self.table_name = table_name
         self.bq_client = bigquery.Client(project=source_project)
+        # Limitadores token-bucket para no superar las cuotas por minuto
+        # de GCP (un 429 en ráfaga es mucho más caro que esperar el turno)
+        self.crm_limiter = AsyncLimiter(int(os.environ.get("CRM_QUOTA_PER_MIN", 30)), 60)
+        self.su_limiter = AsyncLimiter(int(os.environ.get("SU_QUOTA_PER_MIN", 200)), 60)
 
     def get_companies_data(self) -> List[Dict[str, Any]]:
         """Obtiene los datos de compañías desde BigQuery"""
@@ -57,11 +63,11 @@ class GCPProjectCreator:
             logger.error(f"Error al obtener datos de BigQuery: {str(e)}")
             raise
 
-    def create_gcp_project(self, company: Dict[str, Any]) -> Optional[str]:
+    async def create_gcp_project(self, company: Dict[str, Any]) -> Optional[str]:
         """Crea un proyecto GCP para una compañía"""
         project_id = f"{company['new_name'].replace(' ', '-').lower()}"
         display_name = project_id[:30]  # GCP limita a 30 caracteres
-        client = resourcemanager_v3.ProjectsClient()
+        client = resourcemanager_v3.ProjectsAsyncClient()
         project = resourcemanager_v3.Project(
             project_id=project_id,
             display_name=display_name,
@@ -73,11 +79,10 @@ class GCPProjectCreator:
         )
         try:
             logger.info(f"Creando proyecto {project_id} para {company['name']}")
-            operation = client.create_project(request={"project": project})
-            while not operation.done():
-                time.sleep(5)
-                logger.info("Esperando creación de proyecto...")
-            if operation.result().project_id == project_id:
+            async with self.crm_limiter:
+                operation = await client.create_project(request={"project": project})
+            result = await operation.result()
+            if result.project_id == project_id:
                 logger.info(f"Proyecto {project_id} creado exitosamente")
                 return project_id
         except AlreadyExists:
@@ -90,9 +95,9 @@ class GCPProjectCreator:
             logger.error(f"Error creando proyecto {project_id}: {str(e)}")
             return None
 
-    def enable_services(self, project_id: str, services: List[str]) -> bool:
+    async def enable_services(self, project_id: str, services: List[str]) -> bool:
         """Habilita servicios en un proyecto GCP"""
-        client = service_usage_v1.ServiceUsageClient()
+        client = service_usage_v1.ServiceUsageAsyncClient()
         success = True
         for service in services:
             service_name = f"{service}.googleapis.com"
@@ -101,34 +106,63 @@ class GCPProjectCreator:
             )
             try:
                 logger.info(f"Habilitando servicio {service_name} en {project_id}")
-                operation = client.enable_service(request=request)
-                operation.result()
+                async with self.su_limiter:
+                    operation = await client.enable_service(request=request)
+                await operation.result()
                 logger.info(f"Servicio {service_name} habilitado")
             except Exception as e:
                 logger.error(f"Error habilitando {service_name}: {str(e)}")
                 success = False
         return success
 
+    async def process_company(self, company: Dict[str, Any],
+                              services: List[str],
+                              sem: asyncio.Semaphore) -> tuple:
+        """Crea el proyecto y habilita servicios para una compañía"""
+        async with sem:
+            logger.info(f"\nProcesando compañía: {company['name']} (ID: {company['id']})")
+            # 1. Crear proyecto
+            project_id = await self.create_gcp_project(company)
+            if not project_id:
+                return company['name'], None
+            # 2. Habilitar servicios
+            if not await self.enable_services(project_id, services):
+                logger.warning(f"Algunos servicios no se habilitaron en {project_id}")
+            return company['name'], project_id
+
+    async def run_async(self):
+        """Procesa todas las compañías en paralelo (acotado por semáforo)"""
+        companies = self.get_companies_data()
+        required_services = [
+            "bigquery",
+            "bigqueryconnection",
+            "storage",
+            "iam"
+        ]
+        # El trabajo es I/O-bound (APIs remotas); el semáforo limita
+        # cuántos proyectos se crean simultáneamente
+        sem = asyncio.Semaphore(int(os.environ.get("GCP_CONCURRENCY", 8)))
+        tasks = [
+            asyncio.create_task(self.process_company(company, required_services, sem))
+            for company in companies
+        ]
+        # as_completed en lugar de gather: cada resultado se reporta en
+        # cuanto termina, sin esperar a la compañía más lenta
+        ok = failed = 0
+        for future in asyncio.as_completed(tasks):
+            company_name, project_id = await future
+            if project_id:
+                ok += 1
+                logger.info(f"Configuración completada para {company_name} ({project_id})\n")
+            else:
+                failed += 1
+                logger.error(f"No se pudo crear el proyecto para {company_name}")
+        logger.info(f"Resultado: {ok} proyectos creados, {failed} fallidos")
+
     def run(self):
         """Ejecuta el proceso completo"""
         try:
-            companies = self.get_companies_data()
-            required_services = [
-                "bigquery",
-                "bigqueryconnection",
-                "storage",
-                "iam"
-            ]
-            for company in companies:
-                logger.info(f"\nProcesando compañía: {company['name']} (ID: {company['id']})")
-                # 1. Crear proyecto
-                project_id = self.create_gcp_project(company)
-                if not project_id:
-                    continue
-                # 2. Habilitar servicios
-                if not self.enable_services(project_id, required_services):
-                    logger.warning(f"Algunos servicios no se habilitaron en {project_id}")
-                logger.info(f"Configuración completada para {company['name']}\n")
+            asyncio.run(self.run_async())
         except Exception as e:
             logger.error(f"Error en el proceso principal: {str(e)}")
         finally:
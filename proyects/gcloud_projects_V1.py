@@ -3,6 +3,11 @@
 Script simple para leer datos de una tabla de BigQuery y generar comandos de creación de proyectos GCP
 """
 from google.cloud import bigquery
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+import io
+import re
+import shlex
 import subprocess
 import sys
 
@@ -10,6 +15,73 @@ PROJECT_SOURCE = "platform-partners-des"
 DATASET_NAME = "settings"
 TABLE_NAME = "companies"
 
+# Cantidad de empresas procesadas en paralelo en los modos de ejecución real
+MAX_COMPANY_WORKERS = 8
+
+# Datasets de BigQuery a crear en cada proyecto
+DATASETS = ["settings", "fivetran", "bronze", "silver", "gold", "management"]
+
+# Tablas precompiladas para sanear nombres de empresa: una sola pasada
+# con str.translate + un patrón compilado, en lugar de ocho .replace()
+# y recompilar la regex en cada llamada
+_PID_TRANSLATION = str.maketrans(
+    {' ': '-', '&': 'and', '(': None, ')': None, '.': None, ',': None, "'": None, '"': None}
+)
+_INVALID_PID_CHARS = re.compile(r'[^a-z0-9-]')
+
+
+# Cliente BigQuery compartido para el proyecto fuente (lazy): construir un
+# cliente implica resolver credenciales y abrir un pool de conexiones,
+# así que se reutiliza uno solo en todo el script
+_BQ_CLIENT = None
+
+
+def get_bq_client():
+    global _BQ_CLIENT
+    if _BQ_CLIENT is None:
+        _BQ_CLIENT = bigquery.Client(project=PROJECT_SOURCE)
+    return _BQ_CLIENT
+
+
+def fetch_companies(query):
+    """
+    Ejecuta la consulta y descarga los resultados en formato Arrow vía la
+    Storage Read API: los datos llegan en lotes columnares en lugar de
+    fila por fila por REST, mucho más rápido para tablas grandes
+    """
+    table = get_bq_client().query(query).to_arrow(create_bqstorage_client=True)
+    columns = table.column_names
+    return [
+        SimpleNamespace(**dict(zip(columns, values)))
+        for values in zip(*(table[col].to_pylist() for col in columns))
+    ]
+
+
+# Caché en memoria de las filas de companies: los cuatro modos usan la
+# misma consulta y la tabla cambia poco, así que se consulta una sola vez
+# por cláusula WHERE dentro de una misma ejecución
+_companies_cache = {}
+
+
+def load_companies(where=""):
+    """
+    Devuelve las filas de la tabla companies, consultando BigQuery solo
+    la primera vez para cada filtro
+    """
+    if where not in _companies_cache:
+        query = f"""
+            SELECT 
+                company_id, 
+                company_name, 
+                company_new_name,
+                company_project_id
+            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
+            {where}
+            ORDER BY company_id
+        """
+        _companies_cache[where] = fetch_companies(query)
+    return _companies_cache[where]
+
 
 def generate_project_id(company_new_name, company_id):
     """
@@ -24,19 +96,10 @@ def generate_project_id(company_new_name, company_id):
         company_new_name = company_new_name.split('-')[0]
     
     # Convertir a minúsculas, reemplazar espacios con guiones y remover caracteres especiales
-    project_id = company_new_name.lower()
-    project_id = project_id.replace(' ', '-')
-    project_id = project_id.replace('&', 'and')
-    project_id = project_id.replace('(', '')
-    project_id = project_id.replace(')', '')
-    project_id = project_id.replace('.', '')
-    project_id = project_id.replace(',', '')
-    project_id = project_id.replace("'", '')
-    project_id = project_id.replace('"', '')
+    project_id = company_new_name.lower().translate(_PID_TRANSLATION)
     
     # Remover caracteres no válidos para project_id
-    import re
-    project_id = re.sub(r'[^a-z0-9-]', '', project_id)
+    project_id = _INVALID_PID_CHARS.sub('', project_id)
     
     # Asegurar que no empiece ni termine con guión
     project_id = project_id.strip('-')
@@ -68,21 +131,23 @@ def generate_gcp_commands(row):
         print(f"⚠️  No se pudo generar project_id para: {company_name}")
         return None
     
-    # Comando para crear el proyecto (sin --set-as-default)
-    create_project_cmd = f"gcloud projects create {project_id} --name=\"{company_new_name}\""
+    # Comandos como listas argv: se ejecutan sin pasar por /bin/sh
+    # (un proceso menos por comando y sin problemas de quoting)
+    create_project_cmd = ["gcloud", "projects", "create", project_id, f"--name={company_new_name}"]
     
     # Comando para habilitar APIs necesarias
-    enable_apis_cmd = f"gcloud services enable bigquery.googleapis.com --project={project_id}"
-    
-    # Comandos para crear datasets de BigQuery
-    datasets = ["settings", "fivetran", "bronze", "silver", "gold", "management"]
-    create_datasets_cmds = []
-    for dataset in datasets:
-        create_datasets_cmds.append(f"bq mk --project_id={project_id} --dataset --location=US {dataset}")
-    
+    enable_apis_cmd = ["gcloud", "services", "enable", "bigquery.googleapis.com", f"--project={project_id}"]
+
     # Comandos para crear cuenta de servicio
-    create_service_account_cmd = f"gcloud iam service-accounts create fivetran-account-service --display-name=\"Fivetran Account Service\" --project={project_id}"
-    add_bigquery_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:fivetran-account-service@{project_id}.iam.gserviceaccount.com --role=roles/bigquery.admin"
+    create_service_account_cmd = [
+        "gcloud", "iam", "service-accounts", "create", "fivetran-account-service",
+        "--display-name=Fivetran Account Service", f"--project={project_id}"
+    ]
+    add_bigquery_admin_role_cmd = [
+        "gcloud", "projects", "add-iam-policy-binding", project_id,
+        f"--member=serviceAccount:fivetran-account-service@{project_id}.iam.gserviceaccount.com",
+        "--role=roles/bigquery.admin"
+    ]
     
     return {
         'company_id': company_id,
@@ -91,7 +156,7 @@ def generate_gcp_commands(row):
         'project_id': project_id,
         'create_project_cmd': create_project_cmd,
         'enable_apis_cmd': enable_apis_cmd,
-        'create_datasets_cmds': create_datasets_cmds,
+        'datasets': DATASETS,
         'create_service_account_cmd': create_service_account_cmd,
         'add_bigquery_admin_role_cmd': add_bigquery_admin_role_cmd
     }
@@ -112,8 +177,8 @@ def generate_delete_commands(row):
         print(f"⚠️  No se pudo generar project_id para: {company_name}")
         return None
     
-    # Comando para eliminar el proyecto
-    delete_project_cmd = f"gcloud projects delete {project_id} --quiet"
+    # Comando para eliminar el proyecto (lista argv, sin shell)
+    delete_project_cmd = ["gcloud", "projects", "delete", project_id, "--quiet"]
     
     return {
         'company_id': company_id,
@@ -126,49 +191,95 @@ def generate_delete_commands(row):
 
 def execute_command(command, dry_run=True):
     """
-    Ejecuta un comando del sistema
+    Ejecuta un comando del sistema (lista argv, sin shell intermedio)
     """
+    display = shlex.join(command)
     if dry_run:
-        print(f"🔍 DRY-RUN: {command}")
+        print(f"🔍 DRY-RUN: {display}")
         return True
     else:
-        print(f"🚀 EJECUTANDO: {command}")
+        print(f"🚀 EJECUTANDO: {display}")
         try:
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
+            result = subprocess.run(command, shell=False, capture_output=True, text=True)
             if result.returncode == 0:
-                print(f"✅ ÉXITO: {command}")
+                print(f"✅ ÉXITO: {display}")
                 return True
             else:
-                print(f"❌ ERROR: {command}")
+                print(f"❌ ERROR: {display}")
                 print(f"   Error: {result.stderr}")
                 return False
         except Exception as e:
-            print(f"❌ EXCEPCIÓN: {command}")
+            print(f"❌ EXCEPCIÓN: {display}")
             print(f"   Error: {str(e)}")
             return False
 
 
-def update_company_project_in_bq(company_id, project_id):
+def create_datasets(project_id, dataset_ids, dry_run=True):
+    """
+    Crea los datasets de BigQuery usando el cliente nativo en lugar de 'bq mk'
+    (evita lanzar un proceso y re-autenticar por cada dataset)
+    """
+    if dry_run:
+        for dataset_id in dataset_ids:
+            print(f"🔍 DRY-RUN: create_dataset {project_id}.{dataset_id} (location=US)")
+        return len(dataset_ids)
+
+    client = bigquery.Client(project=project_id)
+
+    def _create(dataset_id):
+        try:
+            dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
+            dataset.location = "US"
+            client.create_dataset(dataset, exists_ok=True)
+            print(f"✅ Dataset creado: {project_id}.{dataset_id}")
+            return True
+        except Exception as e:
+            print(f"❌ ERROR creando dataset {project_id}.{dataset_id}: {str(e)}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=len(dataset_ids)) as executor:
+        results = executor.map(_create, dataset_ids)
+    return sum(1 for ok in results if ok)
+
+
+def flush_company_project_updates(updates):
     """
-    Actualiza el campo company_project en la tabla companies para el company_id dado
+    Actualiza company_project_id para todas las empresas procesadas en un
+    solo MERGE: cada UPDATE individual es un job de BigQuery aparte
+    (~1-3s de overhead) y consume la cuota diaria de modificaciones
     """
-    from google.cloud import bigquery
-    client = bigquery.Client(project=PROJECT_SOURCE)
+    if not updates:
+        return
+
+    client = get_bq_client()
     table_ref = f"{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}"
-    query = f"""
-        UPDATE `{table_ref}`
-        SET company_project_id = @project_id
-        WHERE company_id = @company_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("project_id", "STRING", project_id),
-            bigquery.ScalarQueryParameter("company_id", "INT64", company_id),
-        ]
+    temp_table = f"{PROJECT_SOURCE}.{DATASET_NAME}._tmp_company_project_updates"
+
+    # Cargar los pares (company_id, project_id) a una tabla temporal
+    rows = [
+        {"company_id": company_id, "project_id": project_id}
+        for company_id, project_id in updates
+    ]
+    job_config = bigquery.LoadJobConfig(
+        schema=[
+            bigquery.SchemaField("company_id", "INT64"),
+            bigquery.SchemaField("project_id", "STRING"),
+        ],
+        write_disposition="WRITE_TRUNCATE",
     )
-    query_job = client.query(query, job_config=job_config)
-    query_job.result()  # Esperar a que termine
-    print(f"✅ Campo company_project actualizado para company_id={company_id} con project_id={project_id}")
+    client.load_table_from_json(rows, temp_table, job_config=job_config).result()
+
+    # Un solo MERGE reemplaza N UPDATEs
+    query = f"""
+        MERGE `{table_ref}` T
+        USING `{temp_table}` S
+        ON T.company_id = S.company_id
+        WHEN MATCHED THEN
+            UPDATE SET company_project_id = S.project_id
+    """
+    client.query(query).result()
+    client.delete_table(temp_table, not_found_ok=True)
+    print(f"✅ Campo company_project_id actualizado para {len(updates)} empresas en un solo MERGE")
 
 
 def execute_project_creation(commands, dry_run=True):
@@ -192,12 +303,10 @@ def execute_project_creation(commands, dry_run=True):
     if execute_command(commands['enable_apis_cmd'], dry_run):
         success_count += 1
     
-    # 3. Crear datasets
-    for cmd in commands['create_datasets_cmds']:
-        total_commands += 1
-        if execute_command(cmd, dry_run):
-            success_count += 1
-    
+    # 3. Crear datasets (independientes entre sí: se crean en paralelo)
+    total_commands += len(commands['datasets'])
+    success_count += create_datasets(commands['project_id'], commands['datasets'], dry_run)
+
     # 4. Crear cuenta de servicio
     total_commands += 1
     if execute_command(commands['create_service_account_cmd'], dry_run):
@@ -211,10 +320,8 @@ def execute_project_creation(commands, dry_run=True):
     all_success = (success_count == total_commands)
     print(f"\n📊 RESUMEN: {success_count}/{total_commands} comandos {'simulados' if dry_run else 'ejecutados'} exitosamente")
     
-    # Si todo fue exitoso y no es dry_run, actualizar en BigQuery
-    if all_success and not dry_run:
-        update_company_project_in_bq(commands['company_id'], commands['project_id'])
-    
+    # La actualización en BigQuery la acumula el llamador y se hace
+    # en un solo MERGE al final del lote
     return all_success
 
 
@@ -238,101 +345,151 @@ def execute_project_deletion(commands, dry_run=True):
     return success_count == total_commands
 
 
-def dry_run_mode():
+def _render_create_commands(commands, buf):
+    """Muestra los comandos de creación generados para una empresa"""
+    print(f"  🎯 project_id generado: {commands['project_id']}", file=buf)
+    print(file=buf)
+    print("  📝 COMANDOS GENERADOS:", file=buf)
+    print(f"    # Crear proyecto", file=buf)
+    print(f"    {shlex.join(commands['create_project_cmd'])}", file=buf)
+    print(file=buf)
+    print(f"    # Habilitar APIs", file=buf)
+    print(f"    {shlex.join(commands['enable_apis_cmd'])}", file=buf)
+    print(file=buf)
+    print(f"    # Crear datasets BigQuery (cliente nativo)", file=buf)
+    for dataset_id in commands['datasets']:
+        print(f"    create_dataset {commands['project_id']}.{dataset_id} (location=US)", file=buf)
+    print(file=buf)
+    print(f"    # Crear cuenta de servicio Fivetran", file=buf)
+    print(f"    {shlex.join(commands['create_service_account_cmd'])}", file=buf)
+    print(file=buf)
+    print(f"    # Asignar rol de Administrador de BigQuery", file=buf)
+    print(f"    {shlex.join(commands['add_bigquery_admin_role_cmd'])}", file=buf)
+    print(file=buf)
+
+
+def _render_delete_commands(commands, buf):
+    """Muestra los comandos de eliminación generados para una empresa"""
+    print(f"  🎯 project_id a eliminar: {commands['project_id']}", file=buf)
+    print(file=buf)
+    print("  📝 COMANDOS DE ELIMINACIÓN GENERADOS:", file=buf)
+    print(f"    # Eliminar proyecto", file=buf)
+    print(f"    {shlex.join(commands['delete_project_cmd'])}", file=buf)
+
+
+# Configuración por acción: los cuatro modos comparten el mismo flujo
+# (consulta, generación de comandos, ejecución en paralelo, resumen) y
+# solo cambian estas piezas
+MODES = {
+    "create": {
+        "where": "WHERE company_project_id IS NULL",
+        "generate_fn": generate_gcp_commands,
+        "render_fn": _render_create_commands,
+        "execute_fn": execute_project_creation,
+        # Procesos: cada worker supervisa sus subprocesos gcloud y crea
+        # sus propios clientes BigQuery, sin compartir estado
+        "executor_cls": ProcessPoolExecutor,
+        "track_updates": True,
+        "success_label": "Proyectos creados exitosamente",
+    },
+    "delete": {
+        "where": "WHERE company_project_id IS NOT NULL",
+        "generate_fn": generate_delete_commands,
+        "render_fn": _render_delete_commands,
+        "execute_fn": execute_project_deletion,
+        "executor_cls": ThreadPoolExecutor,
+        "track_updates": False,
+        "success_label": "Proyectos eliminados exitosamente",
+    },
+}
+
+
+def process_mode(action, dry_run):
     """
-    Modo de ejecución en seco - solo muestra los comandos
+    Flujo común de los cuatro modos: consulta las empresas, genera los
+    comandos por fila y los muestra (dry-run) o los ejecuta en paralelo
     """
-    print("🔍 MODO DRY-RUN - Solo mostrando comandos (no se ejecutarán)")
-    print("=" * 80)
-    
+    mode = MODES[action]
     try:
         print(f"Conectando a proyecto: {PROJECT_SOURCE}")
         print(f"Dataset: {DATASET_NAME}")
         print(f"Tabla: {TABLE_NAME}")
-        
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        query = f"""
-            SELECT 
-                company_id, 
-                company_name, 
-                company_new_name,
-                company_project_id
-            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-            ORDER BY company_id
-        """
-
         print(f"Ejecutando consulta...")
         
-        # Ejecutar consulta
-        query_job = client.query(query)
-        results = query_job.result()
+        # Consulta compartida con caché en memoria y filtro en SQL
+        results = load_companies(mode["where"])
         
         print("Consulta ejecutada exitosamente")
         print("=" * 80)
         
         count = 0
-        successful_commands = 0
-        print("Generando comandos de creación de proyectos GCP...")
-        print()
+        successful = 0
+        failed = 0
+        pending_commands = []
         
         for row in results:
+            # Salida por empresa en un buffer: una sola escritura a
+            # stdout por empresa en lugar de ~20 syscalls
+            buf = io.StringIO()
             try:
                 count += 1
-                print(f"📋 EMPRESA {count}:")
-                print(f"  company_id: {row.company_id}")
-                print(f"  company_name: {row.company_name}")
-                print(f"  company_new_name: {row.company_new_name}")
-                print(f"  company_project_id: {row.company_project_id}")
-                
-                if row.company_project_id is not None:
-                    print(f"  ⚠️  Ya existe un project_id registrado ({row.company_project_id}), se omite la creación.")
-                    print("-" * 80)
-                    continue
+                print(f"📋 EMPRESA {count}:", file=buf)
+                print(f"  company_id: {row.company_id}", file=buf)
+                print(f"  company_name: {row.company_name}", file=buf)
+                print(f"  company_new_name: {row.company_new_name}", file=buf)
                 
                 # Generar comandos
-                commands = generate_gcp_commands(row)
+                commands = mode["generate_fn"](row)
                 
                 if commands:
-                    successful_commands += 1
-                    print(f"  🎯 project_id generado: {commands['project_id']}")
-                    print()
-                    print("  📝 COMANDOS GENERADOS:")
-                    print(f"    # Crear proyecto")
-                    print(f"    {commands['create_project_cmd']}")
-                    print()
-                    print(f"    # Habilitar APIs")
-                    print(f"    {commands['enable_apis_cmd']}")
-                    print()
-                    print(f"    # Crear datasets BigQuery")
-                    for i, cmd in enumerate(commands['create_datasets_cmds'], 1):
-                        print(f"    {cmd}")
-                    print()
-                    print(f"    # Crear cuenta de servicio Fivetran")
-                    print(f"    {commands['create_service_account_cmd']}")
-                    print()
-                    print(f"    # Asignar rol de Administrador de BigQuery")
-                    print(f"    {commands['add_bigquery_admin_role_cmd']}")
-                    print()
+                    if dry_run:
+                        successful += 1
+                        mode["render_fn"](commands, buf)
+                    else:
+                        pending_commands.append(commands)
                 else:
-                    print("  ❌ No se pudieron generar comandos")
+                    failed += 1
+                    print("  ❌ No se pudieron generar comandos", file=buf)
                 
-                print("-" * 80)
+                print("-" * 80, file=buf)
                 
             except Exception as row_error:
-                print(f"❌ ERROR en fila {count}: {str(row_error)}")
-                print(f"Row problemático: {row}")
-                print(f"Tipo de row: {type(row)}")
-                print("-" * 80)
+                failed += 1
+                print(f"❌ ERROR en fila {count}: {str(row_error)}", file=buf)
+                print(f"Row problemático: {row}", file=buf)
+                print("-" * 80, file=buf)
+            
+            sys.stdout.write(buf.getvalue())
+        
+        if not dry_run:
+            # Ejecutar en paralelo (cada empresa es independiente)
+            completed_updates = []
+            with mode["executor_cls"](max_workers=MAX_COMPANY_WORKERS) as executor:
+                futures = {
+                    executor.submit(mode["execute_fn"], commands, False): commands
+                    for commands in pending_commands
+                }
+                for future in as_completed(futures):
+                    commands = futures[future]
+                    try:
+                        if future.result():
+                            successful += 1
+                            if mode["track_updates"]:
+                                completed_updates.append((commands['company_id'], commands['project_id']))
+                        else:
+                            failed += 1
+                    except Exception as row_error:
+                        failed += 1
+                        print(f"❌ ERROR procesando {commands['company_name']}: {str(row_error)}")
+            
+            if mode["track_updates"]:
+                # Registrar todos los project_id creados en un solo MERGE
+                flush_company_project_updates(completed_updates)
         
-        print(f"📊 RESUMEN:")
+        print(f"\n📊 RESUMEN FINAL:")
         print(f"  Total de empresas procesadas: {count}")
-        print(f"  Comandos generados exitosamente: {successful_commands}")
-        print(f"  Errores: {count - successful_commands}")
+        print(f"  {mode['success_label'] if not dry_run else 'Comandos generados exitosamente'}: {successful}")
+        print(f"  Errores: {failed}")
         
     except Exception as e:
         print(f"❌ ERROR GENERAL: {str(e)}")
@@ -340,6 +497,19 @@ def dry_run_mode():
         import traceback
         print("Traceback completo:")
         traceback.print_exc()
+    finally:
+        if not dry_run:
+            # Volver a dejar el proyecto principal como activo
+            execute_command(['gcloud', 'config', 'set', 'project', 'platform-partners-pro'], dry_run=False)
+
+
+def dry_run_mode():
+    """
+    Modo de ejecución en seco - solo muestra los comandos
+    """
+    print("🔍 MODO DRY-RUN - Solo mostrando comandos (no se ejecutarán)")
+    print("=" * 80)
+    process_mode("create", dry_run=True)
 
 
 def real_execution_mode():
@@ -356,86 +526,7 @@ def real_execution_mode():
         print("❌ Ejecución cancelada por el usuario")
         return
     
-    try:
-        print(f"Conectando a proyecto: {PROJECT_SOURCE}")
-        print(f"Dataset: {DATASET_NAME}")
-        print(f"Tabla: {TABLE_NAME}")
-        
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        query = f"""
-            SELECT 
-                company_id, 
-                company_name, 
-                company_new_name,
-                company_project_id
-            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-            ORDER BY company_id
-        """
-
-        print(f"Ejecutando consulta...")
-        
-        # Ejecutar consulta
-        query_job = client.query(query)
-        results = query_job.result()
-        
-        print("Consulta ejecutada exitosamente")
-        print("=" * 80)
-        
-        count = 0
-        successful_projects = 0
-        failed_projects = 0
-        
-        for row in results:
-            try:
-                count += 1
-                print(f"📋 EMPRESA {count}:")
-                print(f"  company_id: {row.company_id}")
-                print(f"  company_name: {row.company_name}")
-                print(f"  company_new_name: {row.company_new_name}")
-                print(f"  company_project_id: {row.company_project_id}")
-                
-                if row.company_project_id is not None:
-                    print(f"  ⚠️  Ya existe un project_id registrado ({row.company_project_id}), se omite la creación.")
-                    print("-" * 80)
-                    continue
-                
-                # Generar comandos
-                commands = generate_gcp_commands(row)
-                
-                if commands:
-                    # Ejecutar secuencia de creación
-                    if execute_project_creation(commands, dry_run=False):
-                        successful_projects += 1
-                    else:
-                        failed_projects += 1
-                else:
-                    failed_projects += 1
-                    print(f"❌ No se pudieron generar comandos para: {row.company_name}")
-                
-            except Exception as row_error:
-                failed_projects += 1
-                print(f"❌ ERROR en fila {count}: {str(row_error)}")
-                print(f"Row problemático: {row}")
-        
-        print(f"\n📊 RESUMEN FINAL:")
-        print(f"  Total de empresas procesadas: {count}")
-        print(f"  Proyectos creados exitosamente: {successful_projects}")
-        print(f"  Proyectos fallidos: {failed_projects}")
-        
-    except Exception as e:
-        print(f"❌ ERROR GENERAL: {str(e)}")
-        print(f"Tipo de error: {type(e)}")
-        import traceback
-        print("Traceback completo:")
-        traceback.print_exc()
-    finally:
-        # Volver a dejar el proyecto principal como activo
-        execute_command('gcloud config set project platform-partners-pro', dry_run=False)
+    process_mode("create", dry_run=False)
 
 
 def delete_projects_dry_run():
@@ -444,81 +535,7 @@ def delete_projects_dry_run():
     """
     print("🔍 MODO DRY-RUN - ELIMINACIÓN - Solo mostrando comandos (no se ejecutarán)")
     print("=" * 80)
-    
-    try:
-        print(f"Conectando a proyecto: {PROJECT_SOURCE}")
-        print(f"Dataset: {DATASET_NAME}")
-        print(f"Tabla: {TABLE_NAME}")
-        
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        query = f"""
-            SELECT 
-                company_id, 
-                company_name, 
-                company_new_name
-            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-            ORDER BY company_id
-        """
-
-        print(f"Ejecutando consulta...")
-        
-        # Ejecutar consulta
-        query_job = client.query(query)
-        results = query_job.result()
-        
-        print("Consulta ejecutada exitosamente")
-        print("=" * 80)
-        
-        count = 0
-        successful_commands = 0
-        print("Generando comandos de eliminación de proyectos GCP...")
-        print()
-        
-        for row in results:
-            try:
-                count += 1
-                print(f"📋 EMPRESA {count}:")
-                print(f"  company_id: {row.company_id}")
-                print(f"  company_name: {row.company_name}")
-                print(f"  company_new_name: {row.company_new_name}")
-                
-                # Generar comandos de eliminación
-                commands = generate_delete_commands(row)
-                
-                if commands:
-                    successful_commands += 1
-                    print(f"  🎯 project_id a eliminar: {commands['project_id']}")
-                    print()
-                    print("  📝 COMANDOS DE ELIMINACIÓN GENERADOS:")
-                    print(f"    # Eliminar proyecto")
-                    print(f"    {commands['delete_project_cmd']}")
-                else:
-                    print("  ❌ No se pudieron generar comandos de eliminación")
-                
-                print("-" * 80)
-                
-            except Exception as row_error:
-                print(f"❌ ERROR en fila {count}: {str(row_error)}")
-                print(f"Row problemático: {row}")
-                print(f"Tipo de row: {type(row)}")
-                print("-" * 80)
-        
-        print(f"📊 RESUMEN:")
-        print(f"  Total de empresas procesadas: {count}")
-        print(f"  Comandos de eliminación generados exitosamente: {successful_commands}")
-        print(f"  Errores: {count - successful_commands}")
-        
-    except Exception as e:
-        print(f"❌ ERROR GENERAL: {str(e)}")
-        print(f"Tipo de error: {type(e)}")
-        import traceback
-        print("Traceback completo:")
-        traceback.print_exc()
+    process_mode("delete", dry_run=True)
 
 
 def delete_projects_real():
@@ -542,75 +559,7 @@ def delete_projects_real():
         print("❌ Eliminación cancelada por el usuario")
         return
     
-    try:
-        print(f"Conectando a proyecto: {PROJECT_SOURCE}")
-        print(f"Dataset: {DATASET_NAME}")
-        print(f"Tabla: {TABLE_NAME}")
-        
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        query = f"""
-            SELECT 
-                company_id, 
-                company_name, 
-                company_new_name
-            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-            ORDER BY company_id
-        """
-
-        print(f"Ejecutando consulta...")
-        
-        # Ejecutar consulta
-        query_job = client.query(query)
-        results = query_job.result()
-        
-        print("Consulta ejecutada exitosamente")
-        print("=" * 80)
-        
-        count = 0
-        successful_deletions = 0
-        failed_deletions = 0
-        
-        for row in results:
-            try:
-                count += 1
-                
-                # Generar comandos de eliminación
-                commands = generate_delete_commands(row)
-                
-                if commands:
-                    # Ejecutar secuencia de eliminación
-                    if execute_project_deletion(commands, dry_run=False):
-                        successful_deletions += 1
-                    else:
-                        failed_deletions += 1
-                else:
-                    failed_deletions += 1
-                    print(f"❌ No se pudieron generar comandos de eliminación para: {row.company_name}")
-                
-            except Exception as row_error:
-                failed_deletions += 1
-                print(f"❌ ERROR en fila {count}: {str(row_error)}")
-                print(f"Row problemático: {row}")
-        
-        print(f"\n📊 RESUMEN FINAL:")
-        print(f"  Total de empresas procesadas: {count}")
-        print(f"  Proyectos eliminados exitosamente: {successful_deletions}")
-        print(f"  Proyectos fallidos: {failed_deletions}")
-        
-    except Exception as e:
-        print(f"❌ ERROR GENERAL: {str(e)}")
-        print(f"Tipo de error: {type(e)}")
-        import traceback
-        print("Traceback completo:")
-        traceback.print_exc()
-    finally:
-        # Volver a dejar el proyecto principal como activo
-        execute_command('gcloud config set project platform-partners-pro', dry_run=False)
+    process_mode("delete", dry_run=False)
 
 
 def main():
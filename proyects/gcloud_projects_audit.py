@@ -7,11 +7,23 @@ Verifica:
 - Existencia de los 6 datasets
 - Existencia de la cuenta de servicio y su rol
 """
-from google.cloud import bigquery
+from _bq_common import bq_client, iter_companies
 from googleapiclient import discovery
-from google.api_core.exceptions import NotFound
+from googleapiclient.discovery_cache.base import Cache
+from googleapiclient.errors import HttpError
 import google.auth
+import google.auth.transport.requests
+import google_auth_httplib2
+import httplib2
+import asyncio
+import functools
+import hashlib
 import os
+import pathlib
+import random
+import sys
+import threading
+import time
 
 PROJECT_SOURCE = "platform-partners-des"
 DATASET_NAME = "settings"
@@ -20,38 +32,117 @@ REQUIRED_DATASETS = ["settings", "fivetran", "bronze", "silver", "gold", "manage
 SERVICE_ACCOUNT_NAME = "fivetran-account-service"
 SERVICE_ACCOUNT_ROLE = "roles/bigquery.admin"
 
+@functools.lru_cache(maxsize=None)
+def get_credentials():
+    """Credenciales ADC compartidas por todos los clientes: un solo
+    descubrimiento y una sola firma de token en lugar de una por servicio"""
+    credentials, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+    )
+    return credentials
+
+
+def get_bq_client():
+    """Cliente BigQuery compartido vía el módulo común (un solo cliente
+    por proyecto en todo el proceso)"""
+    return bq_client(PROJECT_SOURCE, get_credentials())
+
+
+_thread_local = threading.local()
+
+
+def authorized_http():
+    """Transporte HTTP autorizado por hilo: httplib2 no soporta uso
+    concurrente, así cada worker reutiliza su propia conexión TLS caliente
+    en lugar de abrir un socket nuevo por petición"""
+    if not hasattr(_thread_local, "http"):
+        _thread_local.http = google_auth_httplib2.AuthorizedHttp(
+            get_credentials(), http=httplib2.Http(timeout=30)
+        )
+    return _thread_local.http
+
+
+# Estados HTTP transitorios: sin reintento, una ráfaga de throttling se
+# reportaría como "NO existe" en la auditoría
+_TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+def execute_with_retry(request, max_attempts=5):
+    """Ejecuta una petición de discovery reintentando los errores
+    transitorios con backoff exponencial y jitter; el resto de errores
+    (404, 403...) se propagan de inmediato para no enmascararlos"""
+    delay = 1.0
+    for attempt in range(max_attempts):
+        try:
+            return request.execute(http=authorized_http())
+        except HttpError as e:
+            if e.resp.status not in _TRANSIENT_STATUS or attempt == max_attempts - 1:
+                raise
+        time.sleep(delay + random.uniform(0, delay))
+        delay = min(delay * 2, 30)
+
+
+class DiscoveryFileCache(Cache):
+    """Caché en disco de los documentos de descubrimiento (~1MB por
+    servicio): en ejecuciones posteriores se leen de ~/.cache/gcloud_audit
+    en lugar de descargarse de nuevo antes de empezar la auditoría"""
+
+    def __init__(self):
+        self._dir = pathlib.Path.home() / ".cache" / "gcloud_audit"
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url):
+        return self._dir / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            return self._path(url).read_text()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        try:
+            self._path(url).write_text(content)
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def get_service(name, version):
+    """Construye (una sola vez por servicio) el cliente de discovery,
+    leyendo el documento de descubrimiento de la caché en disco si existe"""
+    return discovery.build(
+        name, version,
+        credentials=get_credentials(),
+        cache_discovery=True,
+        cache=DiscoveryFileCache(),
+    )
+
+
+def get_companies_without_project():
+    """Compañías sin project_id (nulo o vacío): solo para el reporte de
+    omitidas, con proyección mínima filtrada en el servidor"""
+    return list(iter_companies(
+        PROJECT_SOURCE,
+        where="WHERE company_project_id IS NULL OR TRIM(company_project_id) = ''",
+        select=("company_id", "company_name"),
+        credentials=get_credentials(),
+    ))
+
 
 def get_companies_to_audit():
-    client = bigquery.Client(project=PROJECT_SOURCE)
-    query = f"""
-        SELECT company_id, company_name, company_new_name, company_project_id
-        FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-        ORDER BY company_id
-    """
-    results = client.query(query).result()
-    companies = []
-    for row in results:
-        # Considerar nulo o vacío
-        if not row.company_project_id or str(row.company_project_id).strip() == "":
-            companies.append({
-                "company_id": row.company_id,
-                "company_name": row.company_name,
-                "company_new_name": row.company_new_name,
-                "project_id": None  # No hay project_id registrado
-            })
-        else:
-            companies.append({
-                "company_id": row.company_id,
-                "company_name": row.company_name,
-                "company_new_name": row.company_new_name,
-                "project_id": row.company_project_id
-            })
-    return companies
+    """Compañías con project_id registrado: el filtro va en SQL para no
+    traer filas que solo se iban a descartar en Python"""
+    return list(iter_companies(
+        PROJECT_SOURCE,
+        where="WHERE company_project_id IS NOT NULL AND TRIM(company_project_id) != ''",
+        credentials=get_credentials(),
+    ))
 
 
 def project_exists(project_id, crm_service):
     try:
-        project = crm_service.projects().get(projectId=project_id).execute()
+        project = execute_with_retry(crm_service.projects().get(projectId=project_id))
         return project.get("lifecycleState", "") == "ACTIVE"
     except Exception:
         return False
@@ -59,92 +150,121 @@ def project_exists(project_id, crm_service):
 
 def bigquery_api_enabled(project_id, serviceusage):
     try:
-        resp = serviceusage.services().get(
+        resp = execute_with_retry(serviceusage.services().get(
             name=f"projects/{project_id}/services/bigquery.googleapis.com"
-        ).execute()
+        ))
         return resp.get("state", "") == "ENABLED"
     except Exception:
         return False
 
 
-def dataset_exists(project_id, dataset_id, bq_client):
+def existing_datasets(project_id, bq_client):
+    """Devuelve los dataset_id del proyecto con una sola llamada datasets.list
+    (el iterador pagina solo si hay más resultados)"""
     try:
-        bq_client.get_dataset(f"{project_id}.{dataset_id}")
-        return True
-    except NotFound:
-        return False
+        return {ds.dataset_id for ds in bq_client.list_datasets(project=project_id)}
     except Exception:
-        return False
+        return set()
 
 
 def service_account_exists(project_id, sa_name, iam_service):
     sa_email = f"{sa_name}@{project_id}.iam.gserviceaccount.com"
     try:
-        sa = iam_service.projects().serviceAccounts().get(
+        sa = execute_with_retry(iam_service.projects().serviceAccounts().get(
             name=f"projects/{project_id}/serviceAccounts/{sa_email}"
-        ).execute()
+        ))
         return True
     except Exception:
         return False
 
 
-def service_account_has_role(project_id, sa_name, role, crm_service):
-    sa_email = f"{sa_name}@{project_id}.iam.gserviceaccount.com"
+def members_by_role(project_id, crm_service):
+    """Descarga la política IAM del proyecto una sola vez y la indexa por rol:
+    la membresía en un binding ya implica que la cuenta existe"""
     try:
-        policy = crm_service.projects().getIamPolicy(
+        policy = execute_with_retry(crm_service.projects().getIamPolicy(
             resource=project_id, body={}
-        ).execute()
-        bindings = policy.get("bindings", [])
-        for binding in bindings:
-            if binding["role"] == role and f"serviceAccount:{sa_email}" in binding.get("members", []):
-                return True
-        return False
+        ))
+        roles = {}
+        for binding in policy.get("bindings", []):
+            roles.setdefault(binding["role"], set()).update(binding.get("members", []))
+        return roles
     except Exception:
-        return False
+        return {}
 
 
-def main():
-    print("Auditoría de proyectos GCP según tabla companies\n" + "="*60)
-    companies = get_companies_to_audit()
-    credentials, _ = google.auth.default()
-    crm_service = discovery.build("cloudresourcemanager", "v1", credentials=credentials)
-    serviceusage = discovery.build("serviceusage", "v1", credentials=credentials)
-    iam_service = discovery.build("iam", "v1", credentials=credentials)
-    bq_client = bigquery.Client()
-
-    for company in companies:
-        project_id = company["project_id"]
-        if not project_id:
-            print(f"❌ [{company['company_id']}] {company['company_name']} - Sin project_id registrado en la tabla.")
-            print("-"*50)
-            continue
-        print(f"🔎 [{company['company_id']}] {company['company_name']} (project_id: {project_id})")
+async def audit_company(company, crm_service, serviceusage, iam_service, bq_client, sem):
+    """Audita una compañía; las verificaciones independientes se lanzan en paralelo"""
+    async with sem:
+        project_id = company.company_project_id
+        lines = [f"🔎 [{company.company_id}] {company.company_name} (project_id: {project_id})"]
         missing = []
         # 1. Proyecto
-        if not project_exists(project_id, crm_service):
+        if not await asyncio.to_thread(project_exists, project_id, crm_service):
             missing.append("Proyecto NO existe")
         else:
-            # 2. API BigQuery
-            if not bigquery_api_enabled(project_id, serviceusage):
+            # 2-4. API BigQuery, datasets y cuenta de servicio no dependen
+            # entre sí: todas las llamadas REST salen a la vez
+            api_enabled, datasets, roles = await asyncio.gather(
+                asyncio.to_thread(bigquery_api_enabled, project_id, serviceusage),
+                asyncio.to_thread(existing_datasets, project_id, bq_client),
+                asyncio.to_thread(members_by_role, project_id, crm_service),
+            )
+            if not api_enabled:
                 missing.append("API BigQuery NO habilitada")
-            # 3. Datasets
             for ds in REQUIRED_DATASETS:
-                if not dataset_exists(project_id, ds, bq_client):
+                if ds not in datasets:
                     missing.append(f"Dataset '{ds}' NO existe")
-            # 4. Cuenta de servicio
-            if not service_account_exists(project_id, SERVICE_ACCOUNT_NAME, iam_service):
-                missing.append("Cuenta de servicio Fivetran NO existe")
-            else:
-                # 5. Rol
-                if not service_account_has_role(project_id, SERVICE_ACCOUNT_NAME, SERVICE_ACCOUNT_ROLE, crm_service):
+            # 4-5. Cuenta de servicio y rol: la política IAM ya trae ambos;
+            # solo si falta el binding se consulta la cuenta para distinguir
+            # "no existe" de "existe pero sin rol"
+            sa_member = f"serviceAccount:{SERVICE_ACCOUNT_NAME}@{project_id}.iam.gserviceaccount.com"
+            if sa_member not in roles.get(SERVICE_ACCOUNT_ROLE, set()):
+                if not await asyncio.to_thread(service_account_exists, project_id, SERVICE_ACCOUNT_NAME, iam_service):
+                    missing.append("Cuenta de servicio Fivetran NO existe")
+                else:
                     missing.append("Cuenta de servicio Fivetran SIN rol bigquery.admin")
         if missing:
-            print("  Faltantes:")
+            lines.append("  Faltantes:")
             for m in missing:
-                print(f"   - {m}")
+                lines.append(f"   - {m}")
         else:
-            print("  ✅ Todo OK")
-        print("-"*50)
+            lines.append("  ✅ Todo OK")
+        lines.append("-"*50)
+        # Una sola escritura atómica a stdout por compañía: sin syscalls
+        # por línea y sin riesgo de entremezclado entre tareas
+        sys.stdout.write("\n".join(lines) + "\n")
+
+
+async def main_async():
+    print("Auditoría de proyectos GCP según tabla companies\n" + "="*60)
+    companies = get_companies_to_audit()
+    crm_service = get_service("cloudresourcemanager", "v1")
+    serviceusage = get_service("serviceusage", "v1")
+    iam_service = get_service("iam", "v1")
+    bq_client = get_bq_client()
+
+    skipped = [
+        f"❌ [{company.company_id}] {company.company_name} - Sin project_id registrado en la tabla.\n" + "-"*50
+        for company in get_companies_without_project()
+    ]
+    if skipped:
+        sys.stdout.write("\n".join(skipped) + "\n")
+
+    # Refrescar el token una vez antes del fan-out para que los workers
+    # no compitan por el lock de refresco en la primera petición
+    get_credentials().refresh(google.auth.transport.requests.Request())
+
+    # Auditar las compañías en paralelo, acotando las peticiones en vuelo
+    sem = asyncio.Semaphore(20)
+    await asyncio.gather(*[
+        audit_company(company, crm_service, serviceusage, iam_service, bq_client, sem)
+        for company in companies
+    ])
+
+
+def main():
+    asyncio.run(main_async())
 
 if __name__ == "__main__":
     main() 
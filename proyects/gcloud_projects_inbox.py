@@ -2,9 +2,16 @@
 """
 Script para gestionar proyectos GCP para compañías en el inbox
 """
+from _bq_common import bq_client, iter_companies, run_cli
 from google.cloud import bigquery
-import subprocess
-import sys
+from google.cloud import storage
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+import google.auth
+import asyncio
+import os
+import shlex
+import time
 
 # Fuente de configuración INBOX (según tu tabla actualizada)
 # Nota: esta tabla vive en el proyecto pph-inbox.
@@ -14,9 +21,19 @@ TABLE_NAME = "companies"
 
 RUNNER_SERVICE_ACCOUNT = "etl-servicetitan@pph-inbox.iam.gserviceaccount.com"
 
+# Cantidad de empresas procesadas en paralelo en la ejecución real
+# (la cuota de creación de proyectos de GCP tolera este nivel)
+MAX_COMPANY_WORKERS = int(os.environ.get("INBOX_CONCURRENCY", 8))
+
 # Reemplaza esto con el ID real de tu cuenta de facturación de GCP (ej: "01ABCD-12ABCD-34ABCD")
 BILLING_ACCOUNT_ID = "01A94E-AFAEB6-396A55"
 
+# Recursos idénticos para todos los proyectos inbox: definidos una vez a
+# nivel de módulo en lugar de reconstruir las listas por cada fila
+DATASETS = ["bronze", "silver", "staging", "dashboards"]
+BUCKET_SUFFIXES = ["servicetitan", "fivetran"]
+IAM_ROLES = ["roles/bigquery.admin", "roles/storage.admin", "roles/storage.objectAdmin"]
+
 def generate_project_id(company_new_name, company_id):
     """
     Genera el project_id para el proyecto INBOX por compañía.
@@ -42,38 +59,32 @@ def generate_gcp_commands(row):
     # Tomar el project_id desde la tabla (si existe). Si no existe, generarlo.
     project_id = getattr(row, "company_project_id", None) or generate_project_id(company_new_name, company_id)
     
-    # Comando para crear el proyecto (sin --set-as-default)
-    create_project_cmd = f"gcloud projects create {project_id} --name=\"{company_new_name}\""
+    # Comandos como listas argv: se ejecutan sin pasar por /bin/sh, así
+    # que el nombre de la empresa no necesita escaparse
+    create_project_cmd = ["gcloud", "projects", "create", project_id, f"--name={company_new_name}"]
     
     # Comando para vincular la cuenta de facturación (necesario antes de crear buckets y habilitar APIs)
-    link_billing_cmd = f"gcloud billing projects link {project_id} --billing-account={BILLING_ACCOUNT_ID}"
+    link_billing_cmd = ["gcloud", "billing", "projects", "link", project_id, f"--billing-account={BILLING_ACCOUNT_ID}"]
     
     # Comando para habilitar APIs necesarias
-    enable_apis_cmd = f"gcloud services enable bigquery.googleapis.com --project={project_id}"
-    
-    # Comandos para crear datasets de BigQuery (versión reducida para inbox)
-    datasets = ["bronze", "silver", "staging", "dashboards"]
-    create_datasets_cmds = []
-    for dataset in datasets:
-        create_datasets_cmds.append(f"bq mk --project_id={project_id} --dataset --location=US {dataset}")
+    enable_apis_cmd = ["gcloud", "services", "enable", "bigquery.googleapis.com", f"--project={project_id}"]
     
-    # Comandos para crear buckets de Cloud Storage
-    # Nota: el nombre del bucket debe ser globalmente único; usar el project_id ayuda a evitar colisiones.
-    buckets = [f"{project_id}_servicetitan", f"{project_id}_fivetran"]
-    create_buckets_cmds = []
-    for bucket in buckets:
-        create_buckets_cmds.append(f"gsutil mb -p {project_id} -l US gs://{bucket}")
+    # Buckets de Cloud Storage: el nombre debe ser globalmente único;
+    # usar el project_id ayuda a evitar colisiones.
+    buckets = [f"{project_id}_{suffix}" for suffix in BUCKET_SUFFIXES]
     
-    # Comandos para crear cuenta de servicio
-    create_service_account_cmd = f"gcloud iam service-accounts create fivetran-account-service --display-name=\"Fivetran Account Service\" --project={project_id}"
-    add_bigquery_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:fivetran-account-service@{project_id}.iam.gserviceaccount.com --role=roles/bigquery.admin"
-    add_storage_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:fivetran-account-service@{project_id}.iam.gserviceaccount.com --role=roles/storage.admin"
-    add_storage_object_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:fivetran-account-service@{project_id}.iam.gserviceaccount.com --role=roles/storage.objectAdmin"
-
-    # Permisos para el Cloud Run Job runner (Cross-project) para que pueda escribir en el proyecto INBOX temporal
-    add_runner_bigquery_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:{RUNNER_SERVICE_ACCOUNT} --role=roles/bigquery.admin"
-    add_runner_storage_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:{RUNNER_SERVICE_ACCOUNT} --role=roles/storage.admin"
-    add_runner_storage_object_admin_role_cmd = f"gcloud projects add-iam-policy-binding {project_id} --member=serviceAccount:{RUNNER_SERVICE_ACCOUNT} --role=roles/storage.objectAdmin"
+    # Comando para crear cuenta de servicio
+    create_service_account_cmd = [
+        "gcloud", "iam", "service-accounts", "create", "fivetran-account-service",
+        "--display-name=Fivetran Account Service", f"--project={project_id}"
+    ]
+
+    # Cuentas que reciben los IAM_ROLES (Fivetran y el Cloud Run Job
+    # runner cross-project), en una sola actualización de política IAM
+    iam_members = [
+        f"serviceAccount:fivetran-account-service@{project_id}.iam.gserviceaccount.com",
+        f"serviceAccount:{RUNNER_SERVICE_ACCOUNT}",
+    ]
     
     return {
         'company_id': company_id,
@@ -83,65 +94,184 @@ def generate_gcp_commands(row):
         'create_project_cmd': create_project_cmd,
         'link_billing_cmd': link_billing_cmd,
         'enable_apis_cmd': enable_apis_cmd,
-        'create_datasets_cmds': create_datasets_cmds,
-        'create_buckets_cmds': create_buckets_cmds,
+        'datasets': DATASETS,
+        'buckets': buckets,
         'create_service_account_cmd': create_service_account_cmd,
-        'add_bigquery_admin_role_cmd': add_bigquery_admin_role_cmd,
-        'add_storage_admin_role_cmd': add_storage_admin_role_cmd,
-        'add_storage_object_admin_role_cmd': add_storage_object_admin_role_cmd,
-        'add_runner_bigquery_admin_role_cmd': add_runner_bigquery_admin_role_cmd,
-        'add_runner_storage_admin_role_cmd': add_runner_storage_admin_role_cmd,
-        'add_runner_storage_object_admin_role_cmd': add_runner_storage_object_admin_role_cmd
+        'iam_roles': IAM_ROLES,
+        'iam_members': iam_members
     }
 
-def execute_command(command, dry_run=True):
+async def execute_command(command, dry_run=True):
     """
-    Ejecuta un comando del sistema
+    Ejecuta un comando del sistema (lista argv, sin shell intermedio)
+    sin bloquear el event loop
     """
+    display = shlex.join(command)
     if dry_run:
-        print(f"🔍 DRY-RUN: {command}")
+        print(f"🔍 DRY-RUN: {display}")
         return True
     else:
-        print(f"🚀 EJECUTANDO: {command}")
+        print(f"🚀 EJECUTANDO: {display}")
         try:
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                print(f"✅ ÉXITO: {command}")
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await proc.communicate()
+            if proc.returncode == 0:
+                print(f"✅ ÉXITO: {display}")
                 return True
             else:
-                print(f"❌ ERROR: {command}")
-                print(f"   Error: {result.stderr}")
+                print(f"❌ ERROR: {display}")
+                print(f"   Error: {stderr.decode()}")
                 return False
         except Exception as e:
-            print(f"❌ EXCEPCIÓN: {command}")
+            print(f"❌ EXCEPCIÓN: {display}")
             print(f"   Error: {str(e)}")
             return False
 
-def update_company_project_in_bq(company_id, project_id):
+def create_datasets(project_id, dataset_ids, dry_run=True):
+    """
+    Crea los datasets de BigQuery con el cliente nativo: una sola
+    autenticación en proceso en lugar de un 'bq mk' por dataset
+    """
+    if dry_run:
+        for dataset_id in dataset_ids:
+            print(f"🔍 DRY-RUN: create_dataset {project_id}.{dataset_id} (location=US)")
+        return len(dataset_ids)
+
+    client = bigquery.Client(project=project_id)
+    success = 0
+    for dataset_id in dataset_ids:
+        try:
+            dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
+            dataset.location = "US"
+            client.create_dataset(dataset, exists_ok=True)
+            print(f"✅ Dataset creado: {project_id}.{dataset_id}")
+            success += 1
+        except Exception as e:
+            print(f"❌ ERROR creando dataset {project_id}.{dataset_id}: {str(e)}")
+    return success
+
+
+def create_buckets(project_id, bucket_names, dry_run=True):
+    """
+    Crea los buckets de Cloud Storage con el cliente nativo en lugar de gsutil
+    """
+    if dry_run:
+        for bucket in bucket_names:
+            print(f"🔍 DRY-RUN: create_bucket gs://{bucket} (location=US)")
+        return len(bucket_names)
+
+    client = storage.Client(project=project_id)
+    success = 0
+    for bucket in bucket_names:
+        try:
+            client.create_bucket(bucket, location="US")
+            print(f"✅ Bucket creado: gs://{bucket}")
+            success += 1
+        except Exception as e:
+            print(f"❌ ERROR creando bucket gs://{bucket}: {str(e)}")
+    return success
+
+
+def assign_iam_roles(project_id, roles, members, dry_run=True, max_attempts=5):
+    """
+    Asigna todos los roles en una sola lectura-modificación-escritura de la
+    política IAM del proyecto (con el etag de la lectura). Reintenta con
+    backoff si otra escritura concurrente modificó la política (409).
+    """
+    if dry_run:
+        for role in roles:
+            for member in members:
+                print(f"🔍 DRY-RUN: add-iam-policy-binding {project_id} --member={member} --role={role}")
+        return True
+
+    credentials, _ = google.auth.default()
+    crm = discovery.build("cloudresourcemanager", "v1", credentials=credentials)
+    for attempt in range(max_attempts):
+        try:
+            policy = crm.projects().getIamPolicy(resource=project_id, body={}).execute()
+            bindings = policy.setdefault("bindings", [])
+            by_role = {binding["role"]: binding for binding in bindings}
+            changed = False
+            for role in roles:
+                binding = by_role.get(role)
+                if binding is None:
+                    binding = {"role": role, "members": []}
+                    bindings.append(binding)
+                    by_role[role] = binding
+                for member in members:
+                    if member not in binding["members"]:
+                        binding["members"].append(member)
+                        changed = True
+            if not changed:
+                print(f"ℹ️  Roles ya asignados en {project_id}")
+                return True
+            # La política lleva el etag de la lectura: si otro proceso la
+            # cambió entre medio, el set falla con 409 y se reintenta
+            crm.projects().setIamPolicy(
+                resource=project_id, body={"policy": policy}
+            ).execute()
+            print(f"✅ Roles asignados en {project_id} ({len(roles)} roles x {len(members)} cuentas en una sola actualización)")
+            return True
+        except HttpError as e:
+            if e.resp.status == 409 and attempt < max_attempts - 1:
+                wait = 2 ** attempt
+                print(f"⚠️  Política IAM modificada concurrentemente en {project_id}, reintentando en {wait}s...")
+                time.sleep(wait)
+                continue
+            print(f"❌ ERROR asignando roles en {project_id}: {str(e)}")
+            return False
+        except Exception as e:
+            print(f"❌ ERROR asignando roles en {project_id}: {str(e)}")
+            return False
+    return False
+
+
+def flush_company_project_updates(updates):
     """
-    Actualiza el campo company_project_id en la tabla de configuración INBOX para el company_id dado
+    Registra los project_id de todas las compañías procesadas en un solo
+    MERGE: cada UPDATE individual es un job de BigQuery aparte (~1-3s) y
+    consume la cuota diaria de modificaciones de la tabla
     """
-    from google.cloud import bigquery
-    client = bigquery.Client(project=PROJECT_SOURCE)
+    if not updates:
+        return
+
+    client = bq_client(PROJECT_SOURCE)
     table_ref = f"{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}"
+    temp_table = f"{PROJECT_SOURCE}.{DATASET_NAME}._tmp_inbox_project_updates"
+
+    rows = [
+        {"company_id": company_id, "project_id": project_id}
+        for company_id, project_id in updates
+    ]
+    job_config = bigquery.LoadJobConfig(
+        schema=[
+            bigquery.SchemaField("company_id", "INT64"),
+            bigquery.SchemaField("project_id", "STRING"),
+        ],
+        write_disposition="WRITE_TRUNCATE",
+    )
+    client.load_table_from_json(rows, temp_table, job_config=job_config).result()
+
     query = f"""
-        UPDATE `{table_ref}`
-        SET company_project_id = @project_id
-        WHERE company_id = @company_id
+        MERGE `{table_ref}` T
+        USING `{temp_table}` S
+        ON T.company_id = S.company_id
+        WHEN MATCHED THEN
+            UPDATE SET company_project_id = S.project_id
     """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("project_id", "STRING", project_id),
-            bigquery.ScalarQueryParameter("company_id", "INT64", company_id),
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    query_job.result()  # Esperar a que termine
-    print(f"✅ Campo company_project actualizado para company_id={company_id} con project_id={project_id}")
+    client.query(query).result()
+    client.delete_table(temp_table, not_found_ok=True)
+    print(f"✅ Campo company_project_id actualizado para {len(updates)} compañías en un solo MERGE")
 
-def execute_project_creation(commands, dry_run=True):
+async def execute_project_creation(commands, dry_run=True):
     """
-    Ejecuta la secuencia completa de creación de proyecto
+    Ejecuta la secuencia completa de creación de proyecto.
+    Los pasos con dependencias (proyecto → facturación → APIs) van en
+    orden; datasets, buckets y cuenta de servicio se lanzan en paralelo.
     """
     print(f"\n{'='*80}")
     print(f"🏗️  {'DRY-RUN' if dry_run else 'EJECUCIÓN REAL'} - {commands['company_name']}")
@@ -155,90 +285,65 @@ def execute_project_creation(commands, dry_run=True):
     project_ready = False
     
     if dry_run:
-        if execute_command(commands['create_project_cmd'], dry_run):
+        if await execute_command(commands['create_project_cmd'], dry_run):
             success_count += 1
             project_ready = True
     else:
         # Verificar si el proyecto ya existe antes de intentar crearlo
-        describe_cmd = f"gcloud projects describe {commands['project_id']} --format=\"value(projectId)\""
-        result = subprocess.run(describe_cmd, shell=True, capture_output=True, text=True)
-        if result.returncode == 0 and result.stdout.strip():
+        describe_cmd = ["gcloud", "projects", "describe", commands['project_id'], "--format=value(projectId)"]
+        proc = await asyncio.create_subprocess_exec(
+            *describe_cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, _ = await proc.communicate()
+        if proc.returncode == 0 and stdout.decode().strip():
             print(f"ℹ️  Proyecto ya existe: {commands['project_id']} (se omite creación)")
             success_count += 1
             project_ready = True
         else:
-            if execute_command(commands['create_project_cmd'], dry_run):
+            if await execute_command(commands['create_project_cmd'], dry_run):
                 success_count += 1
                 project_ready = True
     
     # 1.5 Vincular cuenta de facturación
     if BILLING_ACCOUNT_ID and BILLING_ACCOUNT_ID != "POR_DEFINIR":
         total_commands += 1
-        if execute_command(commands['link_billing_cmd'], dry_run):
+        if await execute_command(commands['link_billing_cmd'], dry_run):
             success_count += 1
     else:
         print(f"⚠️  Omitiendo vinculación de facturación (BILLING_ACCOUNT_ID no configurado)")
     
-    # 2. Habilitar APIs
-    total_commands += 1
-    if execute_command(commands['enable_apis_cmd'], dry_run):
-        success_count += 1
-    
-    # 3. Crear datasets
-    for cmd in commands['create_datasets_cmds']:
-        total_commands += 1
-        if execute_command(cmd, dry_run):
-            success_count += 1
-    
-    # 4. Crear buckets
-    for cmd in commands['create_buckets_cmds']:
-        total_commands += 1
-        if execute_command(cmd, dry_run):
-            success_count += 1
-    
-    # 5. Crear cuenta de servicio
-    total_commands += 1
-    if execute_command(commands['create_service_account_cmd'], dry_run):
-        success_count += 1
-    
-    # 6. Asignar roles
+    # 2. Habilitar APIs (requisito de datasets y buckets)
     total_commands += 1
-    if execute_command(commands['add_bigquery_admin_role_cmd'], dry_run):
+    if await execute_command(commands['enable_apis_cmd'], dry_run):
         success_count += 1
     
-    total_commands += 1
-    if execute_command(commands['add_storage_admin_role_cmd'], dry_run):
-        success_count += 1
+    # 3-5. Datasets, buckets y cuenta de servicio no dependen entre sí:
+    # se ejecutan en paralelo (datasets y buckets con clientes nativos)
+    total_commands += len(commands['datasets']) + len(commands['buckets']) + 1
+    datasets_ok, buckets_ok, sa_ok = await asyncio.gather(
+        asyncio.to_thread(create_datasets, commands['project_id'], commands['datasets'], dry_run),
+        asyncio.to_thread(create_buckets, commands['project_id'], commands['buckets'], dry_run),
+        execute_command(commands['create_service_account_cmd'], dry_run),
+    )
+    success_count += datasets_ok + buckets_ok + (1 if sa_ok else 0)
     
+    # 6. Asignar roles (requieren que la cuenta de servicio exista):
+    # una sola actualización de la política IAM para los seis bindings
     total_commands += 1
-    if execute_command(commands['add_storage_object_admin_role_cmd'], dry_run):
+    if await asyncio.to_thread(assign_iam_roles, commands['project_id'], commands['iam_roles'], commands['iam_members'], dry_run):
         success_count += 1
-
-    # Roles runner (Cloud Run job runner)
-    total_commands += 1
-    if execute_command(commands.get('add_runner_bigquery_admin_role_cmd', ''), dry_run):
-        if commands.get('add_runner_bigquery_admin_role_cmd'):
-            success_count += 1
-
-    total_commands += 1
-    if execute_command(commands.get('add_runner_storage_admin_role_cmd', ''), dry_run):
-        if commands.get('add_runner_storage_admin_role_cmd'):
-            success_count += 1
-
-    total_commands += 1
-    if execute_command(commands.get('add_runner_storage_object_admin_role_cmd', ''), dry_run):
-        if commands.get('add_runner_storage_object_admin_role_cmd'):
-            success_count += 1
     
     all_success = (success_count == total_commands)
     print(f"\n📊 RESUMEN: {success_count}/{total_commands} comandos {'simulados' if dry_run else 'ejecutados'} exitosamente")
     
-    # Si el proyecto existe o se pudo crear, actualizar company_project_id en la BD (solo si venía vacío)
+    # Si el proyecto existe o se pudo crear (y venía sin project_id), el
+    # llamador registra el par para el MERGE único del final del lote.
     # Esto asegura que el BQ se actualiza aunque un Bucket o IAM role haya fallado
-    if project_ready and not dry_run and not commands.get("row_company_project_id"):
-        update_company_project_in_bq(commands['company_id'], commands['project_id'])
+    needs_update = bool(project_ready and not dry_run and not commands.get("row_company_project_id"))
     
-    return all_success
+    return all_success, needs_update
 
 def dry_run_mode():
     """
@@ -252,30 +357,14 @@ def dry_run_mode():
         print(f"Dataset: {DATASET_NAME}")
         print(f"Tabla: {TABLE_NAME}")
         
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        # Seleccionar todas las compañías INBOX; el project_id se toma desde la tabla.
-        query = f"""
-            SELECT company_id
-                 , company_name
-                 , company_new_name
-                 , company_project_id
-            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-            WHERE company_project_id IS NULL OR company_project_id = ''
-           ORDER BY company_id
-        """
-
-        print(f"Ejecutando consulta:")
-        print(query)
-        print()
-        
-        # Ejecutar consulta
-        query_job = client.query(query)
-        results = query_job.result()
+
+        # Seleccionar todas las compañías INBOX sin project_id registrado;
+        # la lectura va por el módulo compartido (cliente único + Arrow)
+        print(f"Ejecutando consulta...")
+        results = list(iter_companies(
+            PROJECT_SOURCE,
+            where="WHERE company_project_id IS NULL OR company_project_id = ''",
+        ))
         
         print("Consulta ejecutada exitosamente")
         print("=" * 80)
@@ -305,24 +394,30 @@ def dry_run_mode():
                     print()
                     print("  📝 COMANDOS GENERADOS:")
                     print(f"    # Crear proyecto")
-                    print(f"    {commands['create_project_cmd']}")
+                    print(f"    {shlex.join(commands['create_project_cmd'])}")
                     print()
                     if BILLING_ACCOUNT_ID and BILLING_ACCOUNT_ID != "POR_DEFINIR":
                         print(f"    # Vincular cuenta de facturación")
-                        print(f"    {commands['link_billing_cmd']}")
+                        print(f"    {shlex.join(commands['link_billing_cmd'])}")
                         print()
                     print(f"    # Habilitar APIs")
-                    print(f"    {commands['enable_apis_cmd']}")
+                    print(f"    {shlex.join(commands['enable_apis_cmd'])}")
+                    print()
+                    print(f"    # Crear datasets BigQuery (cliente nativo)")
+                    for dataset_id in commands['datasets']:
+                        print(f"    create_dataset {commands['project_id']}.{dataset_id} (location=US)")
                     print()
-                    print(f"    # Crear datasets BigQuery")
-                    for i, cmd in enumerate(commands['create_datasets_cmds'], 1):
-                        print(f"    {cmd}")
+                    print(f"    # Crear buckets Cloud Storage (cliente nativo)")
+                    for bucket in commands['buckets']:
+                        print(f"    create_bucket gs://{bucket} (location=US)")
                     print()
                     print(f"    # Crear cuenta de servicio Fivetran")
-                    print(f"    {commands['create_service_account_cmd']}")
+                    print(f"    {shlex.join(commands['create_service_account_cmd'])}")
                     print()
-                    print(f"    # Asignar rol de Administrador de BigQuery")
-                    print(f"    {commands['add_bigquery_admin_role_cmd']}")
+                    print(f"    # Asignar roles (una sola actualización de política IAM)")
+                    for role in commands['iam_roles']:
+                        for member in commands['iam_members']:
+                            print(f"    add-iam-policy-binding {commands['project_id']} --member={member} --role={role}")
                     print()
                 else:
                     print("  ❌ No se pudieron generar comandos")
@@ -366,30 +461,14 @@ def real_execution_mode():
         print(f"Dataset: {DATASET_NAME}")
         print(f"Tabla: {TABLE_NAME}")
         
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        # Seleccionar todas las compañías INBOX; el project_id se toma desde la tabla.
-        query = f"""
-            SELECT company_id
-                 , company_name
-                 , company_new_name
-                 , company_project_id
-            FROM `{PROJECT_SOURCE}.{DATASET_NAME}.{TABLE_NAME}`
-            WHERE company_project_id IS NULL OR company_project_id = ''
-           ORDER BY company_id
-        """
-
-        print(f"Ejecutando consulta:")
-        print(query)
-        print()
-        
-        # Ejecutar consulta
-        query_job = client.query(query)
-        results = query_job.result()
+
+        # Seleccionar todas las compañías INBOX sin project_id registrado;
+        # la lectura va por el módulo compartido (cliente único + Arrow)
+        print(f"Ejecutando consulta...")
+        results = list(iter_companies(
+            PROJECT_SOURCE,
+            where="WHERE company_project_id IS NULL OR company_project_id = ''",
+        ))
         
         print("Consulta ejecutada exitosamente")
         print("=" * 80)
@@ -397,6 +476,7 @@ def real_execution_mode():
         count = 0
         successful_projects = 0
         failed_projects = 0
+        pending_commands = []
         
         for row in results:
             try:
@@ -412,11 +492,7 @@ def real_execution_mode():
                 commands["row_company_project_id"] = row.company_project_id
                 
                 if commands:
-                    # Ejecutar secuencia de creación
-                    if execute_project_creation(commands, dry_run=False):
-                        successful_projects += 1
-                    else:
-                        failed_projects += 1
+                    pending_commands.append(commands)
                 else:
                     failed_projects += 1
                     print(f"❌ No se pudieron generar comandos para: {row.company_name}")
@@ -426,6 +502,33 @@ def real_execution_mode():
                 print(f"❌ ERROR en fila {count}: {str(row_error)}")
                 print(f"Row problemático: {row}")
         
+        # Ejecutar las creaciones en paralelo (acotado por semáforo)
+        async def run_all(pending):
+            sem = asyncio.Semaphore(MAX_COMPANY_WORKERS)
+            
+            async def run_one(commands):
+                async with sem:
+                    return await execute_project_creation(commands, dry_run=False)
+            
+            return await asyncio.gather(*[run_one(c) for c in pending], return_exceptions=True)
+        
+        completed_updates = []
+        for commands, outcome in zip(pending_commands, asyncio.run(run_all(pending_commands))):
+            if isinstance(outcome, Exception):
+                failed_projects += 1
+                print(f"❌ ERROR procesando {commands['company_name']}: {str(outcome)}")
+                continue
+            all_success, needs_update = outcome
+            if needs_update:
+                completed_updates.append((commands['company_id'], commands['project_id']))
+            if all_success:
+                successful_projects += 1
+            else:
+                failed_projects += 1
+        
+        # Registrar todos los project_id en un solo MERGE
+        flush_company_project_updates(completed_updates)
+        
         print(f"\n📊 RESUMEN FINAL:")
         print(f"  Total de empresas procesadas: {count}")
         print(f"  Proyectos creados exitosamente: {successful_projects}")
@@ -439,27 +542,16 @@ def real_execution_mode():
         traceback.print_exc()
     finally:
         # Volver a dejar el proyecto principal como activo
-        execute_command('gcloud config set project platform-partners-des', dry_run=False)
+        asyncio.run(execute_command(['gcloud', 'config', 'set', 'project', 'platform-partners-des'], dry_run=False))
 
 def main():
     """
     Función principal que permite elegir entre dry-run y ejecución real
     """
-    print("🔧 SCRIPT DE CREACIÓN DE PROYECTOS GCP PARA INBOX")
-    print("=" * 60)
-    print("1. Modo DRY-RUN - Crear proyectos (solo mostrar comandos)")
-    print("2. Modo EJECUCIÓN REAL - Crear proyectos")
-    print("=" * 60)
-    
-    choice = input("Selecciona el modo (1-2): ").strip()
-    
-    if choice == "1":
-        dry_run_mode()
-    elif choice == "2":
-        real_execution_mode()
-    else:
-        print("❌ Opción inválida. Saliendo...")
-        sys.exit(1)
+    run_cli("🔧 SCRIPT DE CREACIÓN DE PROYECTOS GCP PARA INBOX", {
+        "1": ("Modo DRY-RUN - Crear proyectos (solo mostrar comandos)", dry_run_mode),
+        "2": ("Modo EJECUCIÓN REAL - Crear proyectos", real_execution_mode),
+    })
 
 if __name__ == "__main__":
     main()
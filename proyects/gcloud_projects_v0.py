@@ -2,11 +2,9 @@
 """
 Script simple para leer datos de una tabla de BigQuery
 """
-from google.cloud import bigquery
+from _bq_common import DATASET_NAME, TABLE_NAME, iter_companies
 
 PROJECT_ID = "platform-partners-des"
-DATASET_NAME = "settings"
-TABLE_NAME = "companies"
 
 
 def main():
@@ -15,30 +13,12 @@ def main():
         print(f"Dataset: {DATASET_NAME}")
         print(f"Tabla: {TABLE_NAME}")
         
-        # Crear cliente de BigQuery
-        print("Creando cliente BigQuery...")
-        client = bigquery.Client(project=PROJECT_ID)
-        print("Cliente BigQuery creado exitosamente")
-        
-        # Consulta SQL
-        query = f"""
-            SELECT 
-                company_id, 
-                company_name, 
-                company_new_name
-            FROM `{PROJECT_ID}.{DATASET_NAME}.{TABLE_NAME}`
-            ORDER BY company_id
-        """
-
+        # Consulta vía el módulo compartido (cliente único + Arrow)
         print(f"Ejecutando consulta...")
-        print(f"Query: {query}")
-        
-        # Ejecutar consulta
-        print("Iniciando query_job...")
-        query_job = client.query(query)
-        print("Query job creado, obteniendo resultados...")
-        results = query_job.result()
-        print("Resultados obtenidos")
+        results = iter_companies(
+            PROJECT_ID,
+            select=("company_id", "company_name", "company_new_name"),
+        )
         
         print("Consulta ejecutada exitosamente")
         print("=" * 50)
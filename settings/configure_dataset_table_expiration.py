@@ -10,19 +10,37 @@ Este script:
 """
 from google.cloud import bigquery
 from google.api_core.exceptions import NotFound, Forbidden
+from googleapiclient import discovery
+import google.auth
+import google_auth_httplib2
+import httplib2
+import asyncio
+import atexit
+import functools
+import io
 import logging
+import os
+import pickle
+import queue
 import sys
-from typing import List, Dict, Optional
-
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('configure_table_expiration.log'),
-        logging.StreamHandler()
-    ]
-)
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterator, List, Dict, Optional
+
+# Configurar logging: los hilos de trabajo solo encolan registros
+# (QueueHandler); un listener en segundo plano es el único que escribe al
+# archivo y a consola, así ningún worker se bloquea en I/O de disco
+_log_queue = queue.SimpleQueue()
+_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_file_handler = logging.FileHandler('configure_table_expiration.log')
+_file_handler.setFormatter(_formatter)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(_formatter)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+_log_listener = QueueListener(_log_queue, _file_handler, _stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Configuración
@@ -38,14 +56,103 @@ DEFAULT_TABLE_EXPIRATION_MS = None  # None = No configurado
 # Datasets a excluir (que empiecen con estos prefijos)
 EXCLUDED_DATASET_PREFIXES = ["fivetran", "servicetitan_"]
 
+# Cuántas compañías se procesan en paralelo (el trabajo es I/O contra la API)
+MAX_COMPANY_WORKERS = 10
+
+# Límite global de llamadas simultáneas a la API de BigQuery, compartido por
+# todos los hilos; evita ráfagas que disparen 429 cuando crece el paralelismo
+_SEM = threading.BoundedSemaphore(int(os.getenv("BQ_MAX_CONCURRENT", "10")))
+
+# Caché en disco de la lista de compañías: la tabla cambia poco y así las
+# ejecuciones seguidas (listado, dry-run y luego real) no repiten el query
+COMPANIES_CACHE_PATH = "/tmp/companies_cache.pkl"
+COMPANIES_CACHE_TTL = int(os.getenv("COMPANIES_CACHE_TTL", "600"))  # segundos
+
+
+# Tamaño máximo de cada lote HTTP (límite práctico de la API batch)
+BATCH_SIZE = 100
+
+# Regiones donde pueden vivir los datasets de los proyectos; las vistas
+# INFORMATION_SCHEMA son por región, así que se consultan todas en un
+# solo query con UNION ALL (agregar aquí si aparecen datasets en otra)
+REGIONS = ["region-us"]
+
+# Milisegundos en un día, para las conversiones días <-> ms
+_MS_PER_DAY = 86_400_000
+
+# Caché en memoria de los listados de datasets por proyecto:
+# {project_id: (timestamp, [dataset_ids])}. Evita repetir el listado cuando
+# un mismo proyecto se consulta varias veces dentro de la ventana del TTL
+_dataset_cache: Dict[str, tuple] = {}
+_dataset_cache_lock = threading.Lock()
+DATASET_CACHE_TTL = int(os.getenv("BQ_DATASET_CACHE_TTL", "60"))  # segundos
+
+
+@functools.lru_cache(maxsize=None)
+def _credentials():
+    """Credenciales ADC compartidas (un solo descubrimiento por proceso)"""
+    credentials, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+    )
+    return credentials
+
+
+_thread_local = threading.local()
+
+
+def _authorized_http():
+    """
+    Transporte HTTP autorizado por hilo: httplib2 no soporta uso
+    concurrente, así que cada worker de to_thread usa su propia conexión
+    en lugar de compartir la del servicio de discovery
+    """
+    if not hasattr(_thread_local, "http"):
+        _thread_local.http = google_auth_httplib2.AuthorizedHttp(
+            _credentials(), http=httplib2.Http(timeout=30)
+        )
+    return _thread_local.http
+
+
+@functools.lru_cache(maxsize=None)
+def _bq_service():
+    """
+    Servicio REST de BigQuery (googleapiclient), usado solo para los lotes
+    HTTP de patch; el cliente nativo no expone new_batch_http_request.
+    Los execute() llevan su transporte por hilo vía _authorized_http()
+    """
+    return discovery.build('bigquery', 'v2', credentials=_credentials(), cache_discovery=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _client(project_id: str) -> bigquery.Client:
+    """
+    Devuelve un cliente BigQuery por proyecto, reutilizado entre llamadas.
+    Crear el cliente en cada función repetía la carga de credenciales y
+    perdía el pool de conexiones HTTP; con la caché se paga una sola vez.
+    """
+    return bigquery.Client(project=project_id)
+
 
 def get_companies_with_projects() -> List[Dict]:
     """
-    Obtiene todas las compañías con proyectos desde BigQuery
+    Obtiene todas las compañías con proyectos desde BigQuery.
+    El resultado se cachea en disco durante COMPANIES_CACHE_TTL segundos
+    para que ejecuciones consecutivas no repitan el query.
     """
     try:
-        client = bigquery.Client(project=PROJECT_SOURCE)
-        
+        if os.path.exists(COMPANIES_CACHE_PATH):
+            age = time.time() - os.path.getmtime(COMPANIES_CACHE_PATH)
+            if age < COMPANIES_CACHE_TTL:
+                with open(COMPANIES_CACHE_PATH, 'rb') as f:
+                    companies = pickle.load(f)
+                logger.info(f"Se usaron {len(companies)} compañías desde caché ({age:.0f}s)")
+                return companies
+    except (OSError, pickle.PickleError) as e:
+        logger.warning(f"No se pudo leer la caché de compañías: {str(e)}")
+
+    try:
+        client = _client(PROJECT_SOURCE)
+
         query = f"""
             SELECT 
                 company_id, 
@@ -58,19 +165,39 @@ def get_companies_with_projects() -> List[Dict]:
             ORDER BY company_id
         """
         
-        query_job = client.query(query)
-        results = query_job.result()
-        
-        companies = []
-        for row in results:
-            companies.append({
-                'company_id': row.company_id,
-                'company_name': row.company_name,
-                'company_new_name': row.company_new_name,
-                'project_id': row.company_project_id
-            })
-        
+        # Descarga columnar vía la Storage Read API (lotes Arrow decodificados
+        # en C++) en lugar de paginar fila a fila por REST
+        table = client.query(query).to_arrow(create_bqstorage_client=True)
+
+        # Si varias compañías comparten proyecto, procesarlo una sola vez:
+        # los datasets son por proyecto y repetirlo duplicaría todo el trabajo.
+        # setdefault conserva la primera compañía de cada proyecto.
+        rows = table.to_pylist()
+        unique_rows = {}
+        for row in rows:
+            unique_rows.setdefault(row['company_project_id'], row)
+        if len(unique_rows) < len(rows):
+            logger.info(f"{len(rows) - len(unique_rows)} compañías con proyecto repetido, "
+                        "se procesa una sola vez cada proyecto")
+
+        companies = [
+            {
+                'company_id': row['company_id'],
+                'company_name': row['company_name'],
+                'company_new_name': row['company_new_name'],
+                'project_id': row['company_project_id']
+            }
+            for row in unique_rows.values()
+        ]
+
         logger.info(f"Se encontraron {len(companies)} compañías con proyectos")
+
+        try:
+            with open(COMPANIES_CACHE_PATH, 'wb') as f:
+                pickle.dump(companies, f)
+        except (OSError, pickle.PickleError) as e:
+            logger.warning(f"No se pudo escribir la caché de compañías: {str(e)}")
+
         return companies
         
     except Exception as e:
@@ -79,39 +206,119 @@ def get_companies_with_projects() -> List[Dict]:
         return []
 
 
-def list_datasets_in_project(project_id: str) -> List[str]:
+def list_datasets_in_project(project_id: str) -> Iterator[str]:
     """
-    Lista todos los datasets en un proyecto
+    Genera los dataset_id de un proyecto, página a página (page_size=500),
+    sin materializar la lista completa en memoria
     """
+    with _dataset_cache_lock:
+        entry = _dataset_cache.get(project_id)
+    if entry is not None and time.time() - entry[0] < DATASET_CACHE_TTL:
+        logger.info(f"Datasets de {project_id} servidos desde caché ({len(entry[1])})")
+        yield from entry[1]
+        return
+
+    dataset_ids = []
     try:
-        client = bigquery.Client(project=project_id)
-        datasets = list(client.list_datasets())
-        dataset_ids = [dataset.dataset_id for dataset in datasets]
+        client = _client(project_id)
+        for dataset in client.list_datasets(page_size=500):
+            dataset_ids.append(dataset.dataset_id)
+            yield dataset.dataset_id
         logger.info(f"Se encontraron {len(dataset_ids)} datasets en proyecto {project_id}")
-        return dataset_ids
+        # Solo se cachea un listado completo (si hubo error no se guarda)
+        with _dataset_cache_lock:
+            _dataset_cache[project_id] = (time.time(), dataset_ids)
     except Forbidden as e:
         logger.error(f"❌ Permisos insuficientes para proyecto {project_id}: {str(e)}")
         print(f"❌ ERROR de permisos en proyecto {project_id}: {str(e)}")
-        return []
     except Exception as e:
         logger.error(f"❌ Error listando datasets en proyecto {project_id}: {str(e)}")
         print(f"❌ ERROR listando datasets en proyecto {project_id}: {str(e)}")
-        return []
 
 
-def get_dataset_expiration(project_id: str, dataset_id: str) -> Optional[int]:
+def _schemata_query(project_id: str, extra_select: str = "") -> str:
+    """Query UNION ALL sobre las regiones configuradas en REGIONS"""
+    return "\nUNION ALL\n".join(
+        f"""
+        SELECT s.schema_name, o.option_value{extra_select}
+        FROM `{project_id}.{region}`.INFORMATION_SCHEMA.SCHEMATA AS s
+        LEFT JOIN `{project_id}.{region}`.INFORMATION_SCHEMA.SCHEMATA_OPTIONS AS o
+          ON o.schema_name = s.schema_name
+         AND o.option_name = 'default_table_expiration_days'
+        """
+        for region in REGIONS
+    )
+
+
+def fetch_all_dataset_expirations(project_id: str) -> Dict[str, Optional[int]]:
     """
-    Obtiene el valor actual de default_table_expiration_ms de un dataset
+    Obtiene en una sola consulta la expiración por defecto de los datasets
+    de un proyecto, vía INFORMATION_SCHEMA (un query en lugar de un
+    get_dataset por dataset).
+
+    Returns:
+        Dict {dataset_id: default_table_expiration_ms o None si no está configurado}
     """
     try:
-        client = bigquery.Client(project=project_id)
-        dataset = client.get_dataset(f"{project_id}.{dataset_id}")
-        return dataset.default_table_expiration_ms
-    except NotFound:
-        logger.warning(f"Dataset {project_id}.{dataset_id} no encontrado")
+        client = _client(project_id)
+        with _SEM:
+            results = client.query(_schemata_query(project_id)).result()
+
+        expirations = {}
+        for row in results:
+            if row.option_value is not None:
+                expirations[row.schema_name] = int(float(row.option_value) * _MS_PER_DAY)
+            else:
+                expirations[row.schema_name] = None
+        logger.info(f"Expiraciones obtenidas para {len(expirations)} datasets de {project_id}")
+        return expirations
+    except Forbidden as e:
+        logger.error(f"❌ Permisos insuficientes para proyecto {project_id}: {str(e)}")
+        return {}
+    except Exception as e:
+        logger.error(f"❌ Error consultando expiraciones en proyecto {project_id}: {str(e)}")
+        return {}
+
+
+def fetch_datasets_needing_update(project_id: str, target_ms: Optional[int]) -> Optional[Dict[str, bool]]:
+    """
+    Para cada dataset visible en las regiones de REGIONS, calcula en el
+    servidor si su expiración difiere del valor pedido. Devuelve el mapa
+    completo {dataset_id: necesita_actualización}: un dataset que NO
+    aparezca en el mapa está fuera de las regiones consultadas y el
+    llamador debe procesarlo igualmente, no darlo por configurado.
+
+    Returns:
+        Dict {dataset_id: bool}, o None si la consulta falló
+    """
+    if target_ms is None:
+        # Se quiere deshabilitar la expiración: difieren los que la tienen
+        needs_update_expr = ",\n               o.option_value IS NOT NULL AS needs_update"
+        job_config = None
+    else:
+        needs_update_expr = (
+            ",\n               (o.option_value IS NULL"
+            " OR CAST(o.option_value AS FLOAT64) * @ms_per_day != @target) AS needs_update"
+        )
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("ms_per_day", "INT64", _MS_PER_DAY),
+            bigquery.ScalarQueryParameter("target", "INT64", target_ms),
+        ])
+
+    try:
+        client = _client(project_id)
+        query = _schemata_query(project_id, extra_select=needs_update_expr)
+        with _SEM:
+            results = client.query(query, job_config=job_config).result()
+
+        needs_update = {row.schema_name: row.needs_update for row in results}
+        logger.info(f"Estado de expiración evaluado para {len(needs_update)} datasets de {project_id}")
+        return needs_update
+    except Forbidden as e:
+        logger.error(f"❌ Permisos insuficientes para proyecto {project_id}: {str(e)}")
         return None
     except Exception as e:
-        logger.error(f"❌ Error obteniendo expiración de dataset {project_id}.{dataset_id}: {str(e)}")
+        logger.error(f"❌ Error consultando expiraciones en proyecto {project_id}: {str(e)}")
         return None
 
 
@@ -129,12 +336,13 @@ def configure_dataset_expiration(
         Dict con 'success', 'skipped', 'current_value', 'new_value'
     """
     try:
-        client = bigquery.Client(project=project_id)
+        client = _client(project_id)
         dataset_ref = f"{project_id}.{dataset_id}"
         
         # Obtener dataset actual
         try:
-            dataset = client.get_dataset(dataset_ref)
+            with _SEM:
+                dataset = client.get_dataset(dataset_ref)
         except NotFound:
             logger.warning(f"Dataset {dataset_ref} no encontrado")
             return {
@@ -144,7 +352,13 @@ def configure_dataset_expiration(
             }
         
         current_expiration = dataset.default_table_expiration_ms
-        
+
+        if current_expiration is not None:
+            days = current_expiration / _MS_PER_DAY
+            logger.info(f"   Expiración actual: {current_expiration} ms ({days:.0f} días)")
+        else:
+            logger.info(f"   Expiración actual: None (No configurado)")
+
         # Verificar si ya tiene el valor configurado
         # Comparar considerando None
         if current_expiration == expiration_ms:
@@ -161,15 +375,13 @@ def configure_dataset_expiration(
         
         if dry_run:
             if expiration_ms is None:
-                logger.info(f"DRY-RUN: Deshabilitaría expiración en {dataset_ref}")
-                print(f"🔍 DRY-RUN: Deshabilitaría expiración en {dataset_ref}")
-                print(f"   Valor actual: {current_expiration} ms" if current_expiration else "   Valor actual: None (No configurado)")
-                print(f"   Nuevo valor: None (No configurado)")
+                logger.info(f"🔍 DRY-RUN: Deshabilitaría expiración en {dataset_ref}")
+                logger.info(f"   Valor actual: {current_expiration} ms" if current_expiration else "   Valor actual: None (No configurado)")
+                logger.info(f"   Nuevo valor: None (No configurado)")
             else:
-                logger.info(f"DRY-RUN: Configuraría {dataset_ref} con expiration_ms={expiration_ms}")
-                print(f"🔍 DRY-RUN: Configuraría {dataset_ref}")
-                print(f"   Valor actual: {current_expiration} ms" if current_expiration else "   Valor actual: None (No configurado)")
-                print(f"   Nuevo valor: {expiration_ms} ms ({expiration_ms / (24*60*60*1000):.0f} días)")
+                logger.info(f"🔍 DRY-RUN: Configuraría {dataset_ref}")
+                logger.info(f"   Valor actual: {current_expiration} ms" if current_expiration else "   Valor actual: None (No configurado)")
+                logger.info(f"   Nuevo valor: {expiration_ms} ms ({expiration_ms / _MS_PER_DAY:.0f} días)")
             return {
                 'success': True,
                 'skipped': False,
@@ -179,18 +391,17 @@ def configure_dataset_expiration(
         
         # Configurar el nuevo valor (None para deshabilitar)
         dataset.default_table_expiration_ms = expiration_ms
-        client.update_dataset(dataset, ['default_table_expiration_ms'])
+        with _SEM:
+            client.update_dataset(dataset, ['default_table_expiration_ms'])
         
         if expiration_ms is None:
             logger.info(f"✅ Expiración deshabilitada en {dataset_ref}")
-            print(f"✅ Expiración deshabilitada en {dataset_ref}")
-            print(f"   Valor anterior: {current_expiration} ms" if current_expiration else "   Valor anterior: None (No configurado)")
-            print(f"   Nuevo valor: None (No configurado)")
+            logger.info(f"   Valor anterior: {current_expiration} ms" if current_expiration else "   Valor anterior: None (No configurado)")
+            logger.info(f"   Nuevo valor: None (No configurado)")
         else:
             logger.info(f"✅ Configurado {dataset_ref} con expiration_ms={expiration_ms}")
-            print(f"✅ Configurado {dataset_ref}")
-            print(f"   Valor anterior: {current_expiration} ms" if current_expiration else "   Valor anterior: None (No configurado)")
-            print(f"   Nuevo valor: {expiration_ms} ms ({expiration_ms / (24*60*60*1000):.0f} días)")
+            logger.info(f"   Valor anterior: {current_expiration} ms" if current_expiration else "   Valor anterior: None (No configurado)")
+            logger.info(f"   Nuevo valor: {expiration_ms} ms ({expiration_ms / _MS_PER_DAY:.0f} días)")
         
         return {
             'success': True,
@@ -217,6 +428,49 @@ def configure_dataset_expiration(
         }
 
 
+def batch_configure_expirations(
+    project_id: str,
+    dataset_ids: List[str],
+    expiration_ms: Optional[int]
+) -> Dict[str, Optional[str]]:
+    """
+    Aplica el default_table_expiration_ms a varios datasets en lotes HTTP
+    (hasta BATCH_SIZE patch por petición) en lugar de un round-trip por dataset.
+
+    Returns:
+        Dict {dataset_id: None si se aplicó, o el mensaje de error}
+    """
+    service = _bq_service()
+    outcomes: Dict[str, Optional[str]] = {}
+    body = {
+        'defaultTableExpirationMs': str(expiration_ms) if expiration_ms is not None else None
+    }
+
+    def _callback(request_id, response, exception):
+        outcomes[request_id] = str(exception) if exception else None
+
+    for start in range(0, len(dataset_ids), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=_callback)
+        for dataset_id in dataset_ids[start:start + BATCH_SIZE]:
+            batch.add(
+                service.datasets().patch(
+                    projectId=project_id,
+                    datasetId=dataset_id,
+                    body=body
+                ),
+                request_id=dataset_id
+            )
+        try:
+            with _SEM:
+                batch.execute(http=_authorized_http())
+        except Exception as e:
+            logger.error(f"❌ Error ejecutando lote de patch en {project_id}: {str(e)}")
+            for dataset_id in dataset_ids[start:start + BATCH_SIZE]:
+                outcomes.setdefault(dataset_id, str(e))
+
+    return outcomes
+
+
 def should_exclude_dataset(dataset_id: str) -> bool:
     """
     Verifica si un dataset debe ser excluido según los prefijos configurados
@@ -228,25 +482,70 @@ def should_exclude_dataset(dataset_id: str) -> bool:
     return False
 
 
-def process_company_datasets(
-    company: Dict, 
-    expiration_ms: Optional[int], 
-    dry_run: bool = True
+async def process_company_datasets(
+    company: Dict,
+    expiration_ms: Optional[int],
+    dry_run: bool = True,
+    sem: Optional[asyncio.Semaphore] = None
 ) -> Dict:
     """
-    Procesa todos los datasets de una compañía
+    Procesa todos los datasets de una compañía (corrutina).
+    Las llamadas bloqueantes a la API corren en hilos vía asyncio.to_thread;
+    el semáforo acota cuántas compañías avanzan a la vez.
     Excluye datasets que empiecen con los prefijos configurados en EXCLUDED_DATASET_PREFIXES
     """
+    if sem is None:
+        sem = asyncio.Semaphore(MAX_COMPANY_WORKERS)
+    async with sem:
+        return await _process_company_datasets_inner(company, expiration_ms, dry_run)
+
+
+def _partition_datasets(project_id: str) -> tuple:
+    """Consume el generador de datasets y los separa en incluidos/excluidos"""
+    datasets = []
+    excluded_datasets = []
+    for ds in list_datasets_in_project(project_id):
+        if should_exclude_dataset(ds):
+            excluded_datasets.append(ds)
+        else:
+            datasets.append(ds)
+    return datasets, excluded_datasets
+
+
+async def _process_company_datasets_inner(
+    company: Dict,
+    expiration_ms: Optional[int],
+    dry_run: bool
+) -> Dict:
     company_id = company['company_id']
     company_name = company['company_name']
     project_id = company['project_id']
-    
-    print(f"\n{'='*80}")
-    print(f"🏢 PROCESANDO EMPRESA: {company_name}")
-    print(f"   Company ID: {company_id}")
-    print(f"   Project ID: {project_id}")
-    print(f"{'='*80}")
-    
+
+    # Con varias compañías en vuelo, imprimir línea a línea entremezcla la
+    # salida: se acumula todo en un buffer y se emite en un solo write
+    buf = io.StringIO()
+    try:
+        return await _process_company_buffered(
+            company_id, company_name, project_id, expiration_ms, dry_run, buf
+        )
+    finally:
+        sys.stdout.write(buf.getvalue())
+
+
+async def _process_company_buffered(
+    company_id,
+    company_name: str,
+    project_id: str,
+    expiration_ms: Optional[int],
+    dry_run: bool,
+    buf: io.StringIO
+) -> Dict:
+    buf.write(f"\n{'='*80}\n")
+    buf.write(f"🏢 PROCESANDO EMPRESA: {company_name}\n")
+    buf.write(f"   Company ID: {company_id}\n")
+    buf.write(f"   Project ID: {project_id}\n")
+    buf.write(f"{'='*80}\n")
+
     results = {
         'company_id': company_id,
         'company_name': company_name,
@@ -258,82 +557,127 @@ def process_company_datasets(
         'datasets_failed': 0,
         'errors': []
     }
-    
-    # Listar todos los datasets del proyecto
-    all_datasets = list_datasets_in_project(project_id)
-    
-    if not all_datasets:
-        print(f"⚠️  No se encontraron datasets en el proyecto {project_id}")
+
+    # Listar y particionar los datasets del proyecto (bloqueante → hilo)
+    datasets, excluded_datasets = await asyncio.to_thread(_partition_datasets, project_id)
+
+    if not datasets and not excluded_datasets:
+        buf.write(f"⚠️  No se encontraron datasets en el proyecto {project_id}\n")
         results['errors'].append('No se encontraron datasets')
         return results
-    
-    # Filtrar datasets excluidos
-    datasets = [ds for ds in all_datasets if not should_exclude_dataset(ds)]
-    excluded_datasets = [ds for ds in all_datasets if should_exclude_dataset(ds)]
-    
-    results['datasets_found'] = len(all_datasets)
+
+    results['datasets_found'] = len(datasets) + len(excluded_datasets)
     results['datasets_excluded'] = len(excluded_datasets)
-    
-    print(f"📊 Se encontraron {len(all_datasets)} datasets en el proyecto")
+
+    buf.write(f"📊 Se encontraron {results['datasets_found']} datasets en el proyecto\n")
     if excluded_datasets:
-        print(f"🚫 Datasets excluidos ({len(excluded_datasets)}): {', '.join(excluded_datasets)}")
-    print(f"📋 Datasets a procesar: {len(datasets)}")
-    
+        buf.write(f"🚫 Datasets excluidos ({len(excluded_datasets)}): {', '.join(excluded_datasets)}\n")
+    buf.write(f"📋 Datasets a procesar: {len(datasets)}\n")
+
     if not datasets:
-        print(f"⚠️  No hay datasets para procesar (todos fueron excluidos)")
+        buf.write(f"⚠️  No hay datasets para procesar (todos fueron excluidos)\n")
         return results
-    
-    # Procesar cada dataset
-    for dataset_id in datasets:
-        print(f"\n📁 Procesando dataset: {project_id}.{dataset_id}")
-        
-        # Obtener valor actual
-        current_expiration = get_dataset_expiration(project_id, dataset_id)
-        if current_expiration is not None:
-            days = current_expiration / (24*60*60*1000)
-            print(f"   Expiración actual: {current_expiration} ms ({days:.0f} días)")
-        else:
-            print(f"   Expiración actual: None (No configurado)")
-        
-        # Configurar expiración
-        result = configure_dataset_expiration(
-            project_id=project_id,
-            dataset_id=dataset_id,
-            expiration_ms=expiration_ms,
-            dry_run=dry_run
+
+    # INFORMATION_SCHEMA evalúa en el servidor qué datasets ya tienen el
+    # valor pedido; esos se saltan sin más llamadas. Un dataset ausente del
+    # mapa vive fuera de las regiones consultadas (REGIONS) y se procesa
+    # igualmente. Si la consulta falló (None) se procesan todos.
+    needs_update = await asyncio.to_thread(fetch_datasets_needing_update, project_id, expiration_ms)
+    if needs_update is None:
+        datasets_to_update = datasets
+    else:
+        datasets_to_update = [ds for ds in datasets if needs_update.get(ds, True)]
+        results['datasets_skipped'] += len(datasets) - len(datasets_to_update)
+
+    if results['datasets_skipped']:
+        buf.write(f"⏭️  Datasets ya configurados (saltados sin llamadas): {results['datasets_skipped']}\n")
+
+    if dry_run:
+        # En dry-run se conserva el detalle por dataset (valor actual vs
+        # nuevo); las lecturas corren en paralelo en hilos
+        dataset_results = await asyncio.gather(
+            *[
+                asyncio.to_thread(
+                    configure_dataset_expiration, project_id, dataset_id, expiration_ms, True
+                )
+                for dataset_id in datasets_to_update
+            ],
+            return_exceptions=True
         )
-        
-        if result['success']:
-            if result.get('skipped'):
-                results['datasets_skipped'] += 1
+
+        for dataset_id, result in zip(datasets_to_update, dataset_results):
+            if isinstance(result, Exception):
+                results['datasets_failed'] += 1
+                results['errors'].append(f"{dataset_id}: {str(result)}")
+            elif result['success']:
+                if result.get('skipped'):
+                    results['datasets_skipped'] += 1
+                else:
+                    results['datasets_configured'] += 1
             else:
+                results['datasets_failed'] += 1
+                if 'error' in result:
+                    results['errors'].append(f"{dataset_id}: {result['error']}")
+    elif datasets_to_update:
+        # En ejecución real los patch van agrupados en lotes HTTP:
+        # un round-trip cada BATCH_SIZE datasets en lugar de uno por dataset
+        outcomes = await asyncio.to_thread(
+            batch_configure_expirations, project_id, datasets_to_update, expiration_ms
+        )
+        for dataset_id in datasets_to_update:
+            error = outcomes.get(dataset_id)
+            if error is None:
                 results['datasets_configured'] += 1
-        else:
-            results['datasets_failed'] += 1
-            if 'error' in result:
-                results['errors'].append(f"{dataset_id}: {result['error']}")
+                logger.info(f"✅ Configurado {project_id}.{dataset_id}")
+            else:
+                results['datasets_failed'] += 1
+                results['errors'].append(f"{dataset_id}: {error}")
+                logger.error(f"❌ ERROR configurando {project_id}.{dataset_id}: {error}")
     
     # Resumen de la empresa
-    print(f"\n📋 RESUMEN PARA {company_name}:")
-    print(f"   Datasets encontrados: {results['datasets_found']}")
-    print(f"   Datasets excluidos: {results['datasets_excluded']}")
-    print(f"   Datasets configurados: {results['datasets_configured']}")
-    print(f"   Datasets ya configurados (saltados): {results['datasets_skipped']}")
-    print(f"   Datasets con errores: {results['datasets_failed']}")
-    
+    buf.write(f"\n📋 RESUMEN PARA {company_name}:\n")
+    buf.write(f"   Datasets encontrados: {results['datasets_found']}\n")
+    buf.write(f"   Datasets excluidos: {results['datasets_excluded']}\n")
+    buf.write(f"   Datasets configurados: {results['datasets_configured']}\n")
+    buf.write(f"   Datasets ya configurados (saltados): {results['datasets_skipped']}\n")
+    buf.write(f"   Datasets con errores: {results['datasets_failed']}\n")
+
     return results
 
 
+async def _process_all_companies(
+    companies: List[Dict],
+    expiration_ms: Optional[int],
+    dry_run: bool
+) -> List:
+    """
+    Lanza el procesamiento de todas las compañías en paralelo, acotado por
+    un semáforo; devuelve resultados (o excepciones) en el orden de entrada
+    """
+    sem = asyncio.Semaphore(MAX_COMPANY_WORKERS)
+    return await asyncio.gather(
+        *[
+            process_company_datasets(company, expiration_ms, dry_run, sem)
+            for company in companies
+        ],
+        return_exceptions=True
+    )
+
+
+def _expiration_label(expiration_ms: Optional[int]) -> str:
+    """Texto 'ms (días)' del valor de expiración, calculado una sola vez"""
+    if expiration_ms is None:
+        return "None (No configurado - deshabilitar expiración)"
+    return f"{expiration_ms} ms ({expiration_ms / _MS_PER_DAY:.0f} días)"
+
+
 def dry_run_mode(expiration_ms: Optional[int]):
     """
     Modo de ejecución en seco - solo muestra los cambios que se harían
     """
     print("🔍 MODO DRY-RUN - Solo mostrando cambios (no se ejecutarán)")
     print("=" * 80)
-    if expiration_ms is None:
-        print(f"⏰ Valor de expiración a configurar: None (No configurado - deshabilitar expiración)")
-    else:
-        print(f"⏰ Valor de expiración a configurar: {expiration_ms} ms ({expiration_ms / (24*60*60*1000):.0f} días)")
+    print(f"⏰ Valor de expiración a configurar: {_expiration_label(expiration_ms)}")
     print("=" * 80)
     
     companies = get_companies_with_projects()
@@ -349,9 +693,13 @@ def dry_run_mode(expiration_ms: Optional[int]):
     total_to_configure = 0
     total_skipped = 0
     total_failed = 0
-    
-    for company in companies:
-        result = process_company_datasets(company, expiration_ms, dry_run=True)
+
+    # Las compañías son independientes entre sí: se procesan en paralelo
+    for company, result in zip(companies, asyncio.run(_process_all_companies(companies, expiration_ms, True))):
+        if isinstance(result, Exception):
+            total_failed += 1
+            logger.error(f"❌ ERROR procesando empresa {company['company_name']}: {str(result)}")
+            continue
         total_datasets += result['datasets_found']
         total_excluded += result['datasets_excluded']
         total_to_configure += result['datasets_configured']
@@ -376,10 +724,7 @@ def real_execution_mode(expiration_ms: Optional[int]):
     print("🚀 MODO EJECUCIÓN REAL - Configurando expiración de tablas")
     print("⚠️  ADVERTENCIA: Esto modificará la configuración de datasets en BigQuery")
     print("=" * 80)
-    if expiration_ms is None:
-        print(f"⏰ Valor de expiración a configurar: None (No configurado - deshabilitar expiración)")
-    else:
-        print(f"⏰ Valor de expiración a configurar: {expiration_ms} ms ({expiration_ms / (24*60*60*1000):.0f} días)")
+    print(f"⏰ Valor de expiración a configurar: {_expiration_label(expiration_ms)}")
     print("=" * 80)
     
     # Confirmación del usuario
@@ -404,25 +749,25 @@ def real_execution_mode(expiration_ms: Optional[int]):
     successful_companies = 0
     failed_companies = 0
     
-    for company in companies:
-        try:
-            result = process_company_datasets(company, expiration_ms, dry_run=False)
-            total_datasets += result['datasets_found']
-            total_excluded += result['datasets_excluded']
-            total_configured += result['datasets_configured']
-            total_skipped += result['datasets_skipped']
-            total_failed += result['datasets_failed']
-            
-            if result['datasets_failed'] == 0:
-                successful_companies += 1
-            else:
-                failed_companies += 1
-                
-        except Exception as e:
+    # Las compañías son independientes entre sí: se procesan en paralelo
+    for company, result in zip(companies, asyncio.run(_process_all_companies(companies, expiration_ms, False))):
+        if isinstance(result, Exception):
             failed_companies += 1
             total_failed += 1
-            logger.error(f"❌ ERROR procesando empresa {company['company_name']}: {str(e)}")
-            print(f"❌ ERROR procesando empresa {company['company_name']}: {str(e)}")
+            logger.error(f"❌ ERROR procesando empresa {company['company_name']}: {str(result)}")
+            print(f"❌ ERROR procesando empresa {company['company_name']}: {str(result)}")
+            continue
+
+        total_datasets += result['datasets_found']
+        total_excluded += result['datasets_excluded']
+        total_configured += result['datasets_configured']
+        total_skipped += result['datasets_skipped']
+        total_failed += result['datasets_failed']
+
+        if result['datasets_failed'] == 0:
+            successful_companies += 1
+        else:
+            failed_companies += 1
     
     print(f"\n{'='*80}")
     print(f"📊 RESUMEN FINAL:")
@@ -465,26 +810,30 @@ def list_datasets_only():
         print(f"\n🏢 EMPRESA: {company_name}")
         print(f"   Project ID: {project_id}")
         
-        all_datasets = list_datasets_in_project(project_id)
-        
-        if not all_datasets:
+        # Particionar los datasets en una sola pasada sobre el generador
+        datasets = []
+        excluded_datasets = []
+        for ds in list_datasets_in_project(project_id):
+            if should_exclude_dataset(ds):
+                excluded_datasets.append(ds)
+            else:
+                datasets.append(ds)
+
+        if not datasets and not excluded_datasets:
             print(f"   ⚠️  No se encontraron datasets")
         else:
-            # Filtrar datasets excluidos
-            datasets = [ds for ds in all_datasets if not should_exclude_dataset(ds)]
-            excluded_datasets = [ds for ds in all_datasets if should_exclude_dataset(ds)]
-            
             total_datasets += len(datasets)
             total_excluded += len(excluded_datasets)
-            
-            print(f"   📊 Datasets encontrados ({len(all_datasets)}):")
+
+            print(f"   📊 Datasets encontrados ({len(datasets) + len(excluded_datasets)}):")
             if excluded_datasets:
                 print(f"   🚫 Datasets excluidos ({len(excluded_datasets)}): {', '.join(excluded_datasets)}")
             print(f"   📋 Datasets a procesar ({len(datasets)}):")
+            expirations = fetch_all_dataset_expirations(project_id)
             for dataset_id in datasets:
-                expiration = get_dataset_expiration(project_id, dataset_id)
+                expiration = expirations.get(dataset_id)
                 if expiration:
-                    days = expiration / (24*60*60*1000)
+                    days = expiration / _MS_PER_DAY
                     print(f"      - {dataset_id} (expiración: {expiration} ms = {days:.0f} días)")
                 else:
                     print(f"      - {dataset_id} (expiración: No configurada)")
@@ -527,7 +876,7 @@ def get_expiration_value() -> Optional[int]:
                 print("   (Si quieres deshabilitar la expiración, ingresa 'none', '0', o 'deshabilitar')")
                 continue
             
-            expiration_ms = days * 24 * 60 * 60 * 1000
+            expiration_ms = days * _MS_PER_DAY
             return expiration_ms
             
         except ValueError:
@@ -1,22 +1,24 @@
 from google.cloud import bigquery
+import google.protobuf
 import sys
 
+# Cliente a nivel de módulo: se crea una sola vez aunque se repita el query
+client = bigquery.Client(project="platform-partners-des")
+
 def run_query():
     try:
         print(f"Python version: {sys.version}")
         print(f"protobuf version: {google.protobuf.__version__}")
-        
-        client = bigquery.Client(project="platform-partners-des")
+
         query_job = client.query("SELECT 1 AS test")
-        
-        # Método más robusto para obtener resultados
-        results = list(query_job.result())
-        return results[0].test if results else None
-        
+
+        # Solo interesa la primera fila: no hace falta materializar la lista
+        row = next(iter(query_job.result()), None)
+        return row.test if row else None
+
     except Exception as e:
         print(f"Error type: {type(e).__name__}")
         print(f"Full error: {str(e)}")
         raise
 
-import google.protobuf
 print("Result:", run_query())